@@ -1,46 +1,134 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from flask_socketio import SocketIO, emit
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, abort
+from flask_socketio import SocketIO, emit, join_room
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.middleware.proxy_fix import ProxyFix
 import re
+import functools
 import hashlib
+import hmac
+import ipaddress
 import time
+import uuid
+import bus
+import metrics
+import storage
+from boards import Board, BoardRegistry, board_shard
+from broadcaster import BroadcastScheduler
+from commands import ROLE_LEVELS, Caller, CommandRegistry, id_list, integer, load_seed_roles, required, stripped, user_id
+from pagecache import choose_encoding, compress
+from profiler import SamplingProfiler
+from ratelimit import TokenBucketLimiter
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key' # 実際の運用ではより複雑なキーに設定してください
-socketio = SocketIO(app)
 
-# 仮のデータベース（本番では永続化されたDBを使用してください）
-posts = []
-next_post_id = 1
-current_topic = "岡山アンチの投稿を永遠に規制中" # 初期話題
+# 複数ワーカー・複数インスタンスで動かすときは、状態の変更と Socket.IO の配信をバスで共有する
+# BOARD_BUS_URL: local://（既定、1プロセスのみ） / sqlite:///path/to/bus.db（同一マシン上の複数プロセス）
+#                / redis://host:6379/0（複数のマシン・インスタンス）
+# SOCKETIO_MESSAGE_QUEUE: redis:// など Flask-SocketIO が対応するキュー（指定時は配信にこちらを使う）
+# BOARD_BUS_URL を指定しなければ SOCKETIO_MESSAGE_QUEUE を状態の共有にも使う（redis:// 以外なら起動時にエラー）
+BOARD_BUS_URL = os.environ.get('BOARD_BUS_URL') or os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+board_bus = bus.create_bus(BOARD_BUS_URL)
+# SOCKETIO_ASYNC_MODE: gevent / eventlet / threading（未指定ならインストール済みのものから自動で選ぶ）
+async_mode = os.environ.get('SOCKETIO_ASYNC_MODE') or None
+if os.environ.get('SOCKETIO_MESSAGE_QUEUE'):
+    socketio = SocketIO(app, async_mode=async_mode, message_queue=os.environ['SOCKETIO_MESSAGE_QUEUE'])
+else:
+    socketio = SocketIO(app, async_mode=async_mode, client_manager=board_bus.socketio_manager())
 
-# ユーザーの権限とIDに付与するテキスト
-# 'role_name': {'color': 'CSS color', 'suffix': 'Suffix Text'}
+# リバースプロキシ（Render など）の後ろで動かすときは、信頼するプロキシの段数を TRUSTED_PROXY_COUNT に指定する
+# 指定しないと X-Forwarded-For を使わないので、投稿制限・/ban はプロキシのIPに対して行われてしまう
+# Socket.IO の接続にも効くように、SocketIO の後で包む
+TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', '0'))
+if TRUSTED_PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
+
+# 状態変更の通知で自分が出したものを見分けるためのID
+PROCESS_ID = uuid.uuid4().hex
+STATE_CHANNEL = 'board_state'
+
+# 永続化はDB（storage.py）で行い、読み込みはメモリ上の状態から行う。変更は両方に反映する
+storage.init_app(app)
+with app.app_context():
+    _state = storage.load_state()
+
+# 板の一覧 {板ID: 表示名}（DBの boards。/board で増やす。storage.BOARD_ID の板はトップページに表示する）
+board_names = _state['boards']
+
+# 板の状態（投稿・話題・NGワード・投稿規制）は板ごとに、使われたときに読み込む
+# BOARD_IDLE_SECONDS 秒使われず、接続中のクライアントもいない板はメモリから外す。読み込んでおく板は MAX_LOADED_BOARDS 個まで
+BOARD_IDLE_SECONDS = float(os.environ.get('BOARD_IDLE_SECONDS', '600'))
+MAX_LOADED_BOARDS = int(os.environ.get('MAX_LOADED_BOARDS', '100'))
+
+# 板を複数のインスタンスに分けて受け持つときは、SHARD_COUNT に分ける数、SHARD_INDEX にこのインスタンスの番号（0から）を指定する
+# 受け持たない板へのリクエストは 421 を返すので、リバースプロキシで /b/<板ID> と ?board=<板ID> を
+# boards.board_shard と同じ規則で振り分ける
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', '1'))
+SHARD_INDEX = int(os.environ.get('SHARD_INDEX', '0'))
+
+# ユーザーの権限とIDに付与するテキスト、投稿の頻度制限
+# 'role_name': {'color': 'CSS color', 'suffix': 'Suffix Text', 'rate_limit': (1秒あたりの投稿数, 連続で投稿できる数) または None（制限なし）}
 ROLES = {
-    'normal': {'color': 'black', 'suffix': ''},
-    'speaker': {'color': 'darkorange', 'suffix': 'スピーカー'},
-    'manager': {'color': 'blue', 'suffix': 'マネージャー'},
-    'moderator': {'color': 'green', 'suffix': 'モデレーター'},
-    'summit': {'color': '#00fa9a', 'suffix': 'サミット'}, # 水色
-    'operator': {'color': 'red', 'suffix': '運営'} # 赤色
+    'normal': {'color': 'black', 'suffix': '', 'rate_limit': (0.2, 5)},
+    'speaker': {'color': 'darkorange', 'suffix': 'スピーカー', 'rate_limit': (0.5, 10)},
+    'manager': {'color': 'blue', 'suffix': 'マネージャー', 'rate_limit': (1, 20)},
+    'moderator': {'color': 'green', 'suffix': 'モデレーター', 'rate_limit': None},
+    'summit': {'color': '#00fa9a', 'suffix': 'サミット', 'rate_limit': None}, # 水色
+    'operator': {'color': 'red', 'suffix': '運営', 'rate_limit': None} # 赤色
 }
 
+# IPごとの投稿の頻度制限（シードを変えて表示用IDを増やす連投に効く）。制限なしの権限には適用しない
+IP_RATE_LIMIT = (0.5, 10)
+
+# 頻度制限の状態。しばらく投稿していない相手のバケットから捨てるので、メモリは上限の件数までしか使わない
+# ワーカーごとに持つため、複数ワーカーでは全体としてワーカー数倍まで投稿できる
+RATE_LIMIT_MAX_KEYS = 10000
+# RATE_LIMIT=0 で頻度制限を止める（負荷試験用。/kill・/ban は効く）
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT', '1') != '0'
+display_id_limiter = TokenBucketLimiter(RATE_LIMIT_MAX_KEYS)
+ip_limiter = TokenBucketLimiter(RATE_LIMIT_MAX_KEYS)
+
+# ユーザーの権限 {display_id: role_name}
+# スナップショットを全員で共有するため、セッションではなくサーバー側で持つ
+# roles.json の表示用IDを初期値とし、コマンドで変更した権限（DBに保存。解除した 'normal' も含む）で上書きする
+ROLES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'roles.json')
+user_roles = load_seed_roles(ROLES_FILE)
+user_roles.update(_state['user_roles'])
+
 # ユーザーごとのカスタム接尾辞 (suffix_text)
-user_suffixes = {} # {display_id: {'text': 'suffix', 'color': 'magenta'}}
+user_suffixes = _state['user_suffixes'] # {display_id: {'text': 'suffix', 'color': 'magenta'}}
 
 # ユーザーの色設定
-user_colors = {} # {display_id: 'color_code'}
+user_colors = _state['user_colors'] # {display_id: 'color_code'}
+
+# NGワード（板ごと）の照合で、NG_WORD_NORMALIZE=0 なら全角・半角などの表記ゆれを区別する
+NG_WORD_NORMALIZE = os.environ.get('NG_WORD_NORMALIZE', '1') != '0'
 
-# NGワードリスト
-ng_words = []
+# /kill・/ban で投稿を禁止した相手 {'display_id': {表示用ID, ...}, 'ip': {IP, ...}}
+blocklists = {'display_id': set(), 'ip': set()}
+for _block in _state['blocks']:
+    blocklists[_block['kind']].add(_block['value'])
 
-# 投稿禁止設定
-prevent_blue_id_post = False
-restrict_blue_id_post = False
-stop_blue_id_until = 0 # タイムスタンプ
+# 板の部屋宛てのイベントと再同期要求をまとめる間隔（秒）。BROADCAST_INTERVAL で変えられる（0.05〜0.1 程度）
+BROADCAST_INTERVAL = float(os.environ.get('BROADCAST_INTERVAL', '0.05'))
 
-# 投稿最大数
-max_posts = 100
+# 計測値（/metrics で Prometheus 形式のテキストとして返す）。値はワーカーごとに持つ
+post_message_seconds = metrics.histogram('bbs_post_message_seconds', '投稿・コマンドの処理時間（秒）')
+get_post_data_seconds = metrics.histogram('bbs_get_post_data_seconds', '投稿を表示用の辞書にする時間（秒）')
+ng_check_seconds = metrics.histogram('bbs_ng_check_seconds', 'NGワードの照合時間（秒）')
+emit_seconds = metrics.histogram('bbs_emit_seconds', 'Socket.IO の配信にかかった時間（秒）', ['event'])
+connected_clients = metrics.gauge('bbs_connected_clients', '接続中の Socket.IO クライアント数')
+posts_total = metrics.counter('bbs_posts_total', '受け付けた投稿数')
+commands_total = metrics.counter('bbs_commands_total', '実行したコマンド数', ['command'])
+rejected_posts_total = metrics.counter('bbs_rejected_posts_total', '投稿を受け付けなかった数', ['reason'])
+metrics.gauge('bbs_boards_loaded', 'メモリに読み込んでいる板の数', func=lambda: len(boards))
+metrics.gauge('bbs_posts_in_memory', 'メモリ上の投稿数（読み込んでいる板の合計）', func=lambda: sum(len(b.posts) for b in boards.values()))
+metrics.gauge('bbs_ng_words', 'NGワードの数（読み込んでいる板の合計）', func=lambda: sum(len(b.ng_words) for b in boards.values()))
+
+# /profile で起動するサンプリングプロファイラー（結果は /debug/profile）
+profiler = SamplingProfiler()
+metrics.gauge('bbs_profiler_running', 'プロファイラーが採取中なら 1', func=lambda: int(profiler.running))
 
 def get_display_id(name, seed):
     """名前とシード値から一意の表示用IDを生成する"""
@@ -50,18 +138,125 @@ def get_display_id(name, seed):
     return hash_object.hexdigest()[:7].upper()
 
 def get_user_role(display_id):
-    """ユーザーの権限を取得する（セッションから）"""
-    return session.get(f'role_{display_id}', 'normal')
+    """ユーザーの権限を取得する"""
+    return user_roles.get(display_id, 'normal')
 
 def set_user_role(display_id, role):
-    """ユーザーの権限を設定する（セッションに保存）"""
+    """ユーザーの権限を設定する"""
     if role in ROLES:
-        session[f'role_{display_id}'] = role
+        storage.set_user_role(display_id, role)
+        apply_change('user_role', display_id=display_id, role=role)
         return True
     return False
 
-def get_post_data(post):
-    display_id = get_display_id(post['name'], post['seed'])
+@get_post_data_seconds.timed
+def get_post_data(board, post):
+    """投稿を表示用の辞書にする（描画結果は板ごとにキャッシュする）"""
+    post_data = board.rendered_posts.get(post.id)
+    if post_data is None:
+        post_data = build_post_data(post)
+        board.rendered_posts[post.id] = post_data
+        board.rendered_ids_by_display_id.setdefault(post.display_id, set()).add(post.id)
+    return post_data
+
+def invalidate_display_id(display_id):
+    """表示用IDの見た目が変わったので、読み込んでいる全ての板でそのIDの描画済み投稿を捨てる"""
+    for board in boards.values():
+        board.invalidate_rendered_posts(display_id)
+        board.page_cache.bump()
+
+def refresh_boards(exclude=()):
+    """このプロセスにクライアントがいる板（exclude を除く）の部屋にスナップショットを送り直し、送った板IDを返す"""
+    refreshed = []
+    for board in boards.values():
+        if board.clients > 0 and board.id not in exclude:
+            board.broadcaster.refresh()
+            refreshed.append(board.id)
+    return refreshed
+
+def apply_user_role(display_id, role):
+    user_roles[display_id] = role # 'normal' も残す（roles.json で付与された権限の解除）
+    invalidate_display_id(display_id)
+
+def apply_user_color(display_id, color):
+    user_colors[display_id] = color
+    invalidate_display_id(display_id)
+
+def apply_user_suffix(display_id, text, color):
+    user_suffixes[display_id] = {'text': text, 'color': color}
+    invalidate_display_id(display_id)
+
+def apply_block_added(blocklist, value):
+    blocklists[blocklist].add(value)
+
+def apply_blocks_removed(value):
+    for blocked in blocklists.values():
+        blocked.discard(value)
+
+def apply_board_created(board_id, name):
+    board_names[board_id] = name
+    for board in boards.values():
+        board.page_cache.bump() # ページの板の一覧が変わる
+
+# 状態変更の種類ごとの反映関数（他のワーカーからの通知にも使う）
+# 板ごとの状態の変更（反映先の板を最初の引数に取る）
+BOARD_CHANGE_HANDLERS = {
+    'post_added': Board.apply_post_added,
+    'posts_deleted': Board.apply_posts_deleted,
+    'posts_cleared': Board.apply_posts_cleared,
+    'board_settings': Board.apply_settings,
+    'ng_word_added': Board.apply_ng_word_added,
+    'ng_word_removed': Board.apply_ng_word_removed,
+}
+# 板によらない、ユーザーごとの状態の変更
+CHANGE_HANDLERS = {
+    'user_role': apply_user_role,
+    'user_color': apply_user_color,
+    'user_suffix': apply_user_suffix,
+    'block_added': apply_block_added,
+    'blocks_removed': apply_blocks_removed,
+    'board_created': apply_board_created,
+}
+# 表示用IDの見た目を変える変更（全ての板の表示に関わるので、スナップショットを送り直す）
+DISPLAY_CHANGES = {'user_role', 'user_color', 'user_suffix'}
+
+def _apply_change(kind, board, data):
+    if board is None:
+        return CHANGE_HANDLERS[kind](**data)
+    result = BOARD_CHANGE_HANDLERS[kind](board, **data)
+    board.page_cache.bump()
+    return result
+
+def apply_change(kind, board=None, **data):
+    """状態の変更をこのプロセスに反映し、他のワーカーにも知らせる（DBへの保存は呼び出し側で行う）
+
+    板ごとの状態の変更では、その板を board に渡す。反映関数の戻り値（'post_added' なら追い出した投稿）を返す。
+    """
+    result = _apply_change(kind, board, data)
+    message = {'origin': PROCESS_ID, 'kind': kind, 'board_id': board.id if board is not None else None, 'data': data}
+    if kind in DISPLAY_CHANGES:
+        # 部屋宛ての送信は全ワーカーのクライアントに届くので、送った板を知らせて他のワーカーが重ねて送らないようにする
+        message['refreshed'] = refresh_boards()
+    board_bus.publish(STATE_CHANNEL, message)
+    return result
+
+def handle_remote_change(message):
+    """他のワーカーで起きた状態変更をこのプロセスのメモリに反映する"""
+    if message['origin'] == PROCESS_ID:
+        return
+    if message['board_id'] is not None:
+        # 読み込んでいない板は、次に読み込むときにDBから最新の状態を読む
+        boards.apply(message['board_id'], lambda board: _apply_change(message['kind'], board, message['data']))
+        return
+    _apply_change(message['kind'], None, message['data'])
+    if message['kind'] in DISPLAY_CHANGES:
+        # 変更したワーカーが送っていない板（そのワーカーにはクライアントがいない板）だけを送る
+        refresh_boards(exclude=message['refreshed'])
+
+board_bus.subscribe(STATE_CHANNEL, handle_remote_change)
+
+def build_post_data(post):
+    display_id = post.display_id
     role = get_user_role(display_id)
     role_info = ROLES.get(role, ROLES['normal'])
 
@@ -82,9 +277,9 @@ def get_post_data(post):
         suffix_color = suffix_data['color'] # /addで設定された色を使用
 
     return {
-        'id': post['id'],
-        'name': post['name'],
-        'message': post['message'],
+        'id': post.id,
+        'name': post.name,
+        'message': post.message,
         'name_color': name_color,
         'display_id': display_id,
         'id_color': id_color, # 現在は常に青緑
@@ -92,371 +287,620 @@ def get_post_data(post):
         'suffix_color': suffix_color
     }
 
-def check_ng_words(message):
-    for word in ng_words:
-        if word in message:
-            return True
-    return False
+@ng_check_seconds.timed
+def check_ng_words(board, message):
+    return board.ng_matcher.search(message)
+
+def get_client_ip():
+    return request.remote_addr or ''
+
+def check_flood(display_id, user_role, ip):
+    """/kill・/ban と頻度制限を確認し、投稿できなければ (理由, 文言) を返す
 
-@app.route('/')
-def index():
-    # 投稿を逆順にして表示（最新のものが上に来るように）
-    display_posts = [get_post_data(post) for post in posts]
-    
-    # セッションから前回の入力内容をロード
-    prev_message = session.pop('prev_message', '')
-    prev_name = session.pop('prev_name', '')
-    prev_seed = session.pop('prev_seed', '')
-
-    return render_template('index.html', 
-                           posts=display_posts[::-1], 
-                           current_topic=current_topic,
+    運営は /kill・/ban の対象にしない（同じIPを共有する相手をBANしたり、自分の投稿番号をBANしたりしても
+    /revive で戻せるように）。
+    """
+    if user_role != 'operator' and (display_id in blocklists['display_id'] or ip in blocklists['ip']):
+        return 'blocked', 'このIDまたはIPからの投稿は禁止されています。'
+    rate_limit = ROLES.get(user_role, ROLES['normal'])['rate_limit']
+    if rate_limit is None or not RATE_LIMIT_ENABLED:
+        return None
+    # IPを先に見る（表示用IDを使い捨てる連投では、IDごとのバケットを作る前に止まる）
+    wait = ip_limiter.acquire(ip, *IP_RATE_LIMIT) or display_id_limiter.acquire(display_id, *rate_limit)
+    if wait:
+        return 'rate_limited', f'投稿の間隔が短すぎます。{int(wait) + 1}秒後にもう一度投稿してください。'
+    return None
+
+def broadcast(event, *args, **kwargs):
+    """socketio.emit に配信時間の計測を付けたもの"""
+    with emit_seconds.time(event):
+        socketio.emit(event, *args, **kwargs)
+
+def get_posts_page(board, before=None, limit=None):
+    """新しい順に1ページ分の投稿と、続きを読むためのカーソルを返す"""
+    limit = limit or board.page_size
+    page = board.posts.newest(limit=limit + 1, before=before)
+    return {
+        'posts': [get_post_data(board, p) for p in page[:limit]],
+        'next_before': page[limit - 1].id if len(page) > limit else None,
+    }
+
+def get_posts_snapshot(board):
+    """最新ページのスナップショット（接続時・取りこぼし検知時に送る）"""
+    snapshot = get_posts_page(board)
+    snapshot.update({
+        'current_topic': board.topic,
+        'max_posts': board.max_posts,
+        'page_size': board.page_size,
+    })
+    return snapshot
+
+def get_posts_since(board, last_id):
+    """last_id より新しい投稿だけを新しい順で返す。差分で追いつけない場合は None
+
+    差分は1ページ分（page_size 件）までにする。それより多く取りこぼしたクライアントや、
+    投稿を1件も持っていないクライアント（last_id が0以下）には、まとめて送るスナップショットで返す。
+    """
+    latest_id = board.posts.latest_id()
+    if last_id <= 0 or latest_id is None or last_id > latest_id:
+        # /clear でIDがリセットされた等、クライアントの状態が古すぎる
+        return None
+    new_posts = board.posts.newest(limit=board.page_size + 1, after=last_id)
+    if len(new_posts) > board.page_size:
+        return None
+    return [get_post_data(board, post) for post in new_posts]
+
+def load_board(board_id):
+    """板をDBから読み込む（boards が初めて使われた板に対して呼ぶ）"""
+    board = Board(board_id, storage.load_board(board_id), ng_normalize=NG_WORD_NORMALIZE)
+
+    def emit_to_board(event, data, to=None):
+        broadcast(event, data, to=to or board.room)
+
+    # 板の部屋宛ての配信はすべてこれを通し、BROADCAST_INTERVAL ごとに1つの batch イベントにまとめて送る
+    board.broadcaster = BroadcastScheduler(socketio, emit_to_board, lambda: get_posts_snapshot(board), BROADCAST_INTERVAL)
+    return board
+
+boards = BoardRegistry(load_board, BOARD_IDLE_SECONDS, MAX_LOADED_BOARDS)
+
+def serves_board(board_id):
+    """このインスタンスが受け持つ板か"""
+    return board_id in board_names and board_shard(board_id, SHARD_COUNT) == SHARD_INDEX
+
+def get_request_board(board_id):
+    """URL・フォームで指定された板（ない板なら 404、他のインスタンスが受け持つ板なら 421 で中断する）"""
+    if board_id not in board_names:
+        abort(404)
+    if not serves_board(board_id):
+        abort(421)
+    return boards.get(board_id)
+
+def get_board_context(board):
+    """ページのうち、その板を見る全員に共通する部分（最初の1ページ分の投稿リストは描画済みのHTMLにする）"""
+    def build():
+        first_page = get_posts_page(board)
+        return {
+            'posts_html': render_template('post_rows.html', posts=first_page['posts']),
+            'last_post_id': first_page['posts'][0]['id'] if first_page['posts'] else 0,
+            'next_before': first_page['next_before'],
+            'current_topic': board.topic,
+            'max_posts': board.max_posts,
+            'page_size': board.page_size,
+        }
+    return board.page_cache.get('board', build)
+
+def render_board_page(board, prev_message='', prev_name='', prev_seed=''):
+    return render_template('index.html',
+                           board_id=board.id,
+                           boards=board_names,
                            prev_message=prev_message,
                            prev_name=prev_name,
-                           prev_seed=prev_seed)
+                           prev_seed=prev_seed,
+                           **get_board_context(board))
 
-@app.route('/post', methods=['POST'])
-def post_message():
-    global next_post_id, current_topic, prevent_blue_id_post, restrict_blue_id_post, stop_blue_id_until, ng_words
+@app.route('/', defaults={'board_id': storage.BOARD_ID})
+@app.route('/b/<board_id>')
+def index(board_id):
+    board = get_request_board(board_id)
+    encoding = choose_encoding(request.accept_encodings)
 
-    message = request.form['message']
-    name = request.form['name']
-    seed = request.form['seed']
+    if '_flashes' in session or 'prev_message' in session:
+        # 投稿・コマンドの直後は、結果の表示と前回の入力内容を入れてその人向けに描画する
+        body = render_board_page(board, session.pop('prev_message', ''), session.pop('prev_name', ''), session.pop('prev_seed', ''))
+        response = make_response(compress(body.encode(), encoding))
+        response.headers['Cache-Control'] = 'private, no-store'
+    else:
+        # その板を見る全員に同じページなので、版数ごとに描画・圧縮した結果を使い回し、変わっていなければ 304 を返す
+        page_cache = board.page_cache
+        version, updated_at = page_cache.version, page_cache.updated_at
+        body = page_cache.get(('page', encoding), lambda: compress(render_board_page(board).encode(), encoding))
+        response = make_response(body)
+        # ワーカーごと・板を読み込み直すごとに版数の数え始めが違うので、プロセスIDと板を読み込んだ時刻も含める
+        response.set_etag(f'{PROCESS_ID}-{board.loaded_at:x}-{version}-{encoding}')
+        response.last_modified = updated_at
+        response.headers['Cache-Control'] = 'no-cache' # 毎回 ETag で確認させる
 
-    # 入力値をセッションに保存（リダイレクト後にフォームに再入力するため）
-    session['prev_message'] = message
-    session['prev_name'] = name
-    session['prev_seed'] = seed
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response.make_conditional(request)
+
+# 1回に返す投稿数の上限（/api/posts・/search の limit と、/range で設定する最初のページの件数）
+MAX_PAGE_SIZE = 200
+
+@app.route('/api/posts')
+def api_posts():
+    """before より古い投稿を新しい順に limit 件返す（無限スクロール用）"""
+    board = get_request_board(request.args.get('board', storage.BOARD_ID))
+    before = request.args.get('before', type=int)
+    limit = min(max(request.args.get('limit', board.page_size, type=int), 1), MAX_PAGE_SIZE)
+    return jsonify(get_posts_page(board, before=before, limit=limit))
+
+@app.route('/search')
+def search_posts():
+    """本文に q を含む投稿を新しい順に返す（before より古いものを limit 件ずつ）"""
+    board = get_request_board(request.args.get('board', storage.BOARD_ID))
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_PAGE_SIZE)
+    before = request.args.get('before', type=int)
+
+    matched_ids = sorted(board.post_index.search(query), reverse=True)
+    total = len(matched_ids)
+    if before is not None:
+        matched_ids = [post_id for post_id in matched_ids if post_id < before]
+    page_ids = matched_ids[:limit]
+    page_posts = [board.posts.get(post_id) for post_id in page_ids]
+    return jsonify({
+        'query': query,
+        'total': total,
+        'posts': [get_post_data(board, post) for post in page_posts if post is not None],
+        'next_before': page_ids[-1] if len(matched_ids) > limit else None,
+    })
+
+# スラッシュコマンド（必要な権限と引数の解析方法を添えて登録する）
+commands = CommandRegistry()
+
+@commands.register('/del', 'speaker', parse=id_list('削除する投稿のIDを正しく指定してください。(例: /del 1,2,3)'))
+def command_del(caller, post_ids):
+    board = caller.board
+    found_ids = [post_id for post_id in post_ids if post_id in board.posts]
+    if not found_ids:
+        return 'info', '指定された投稿IDは見つかりませんでした。'
+    storage.delete_posts(board.id, found_ids)
+    apply_change('posts_deleted', board, post_ids=found_ids)
+    board.broadcaster.posts_deleted(found_ids)
+    return 'success', f'{len(found_ids)}件の投稿を削除しました。'
+
+@commands.register('/clear', 'manager')
+def command_clear(caller, arg):
+    board = caller.board
+    storage.clear_posts(board.id)
+    apply_change('posts_cleared', board)
+    board.broadcaster.posts_cleared()
+    return 'success', '全ての投稿が削除され、IDがリセットされました。'
+
+@commands.register('/topic', 'moderator')
+def command_topic(caller, topic):
+    board = caller.board
+    storage.update_board(board.id, topic=topic)
+    apply_change('board_settings', board, topic=topic)
+    board.broadcaster.topic_updated(topic)
+    return 'success', f'話題を「{topic}」に変更しました。'
+
+# 権限の付与・解除 {コマンド: (必要な権限, 設定する権限, 結果の文言)}
+ROLE_COMMANDS = {
+    '/speaker': ('manager', 'speaker', 'にスピーカー権限を付与'),
+    '/manager': ('moderator', 'manager', 'にマネージャー権限を付与'),
+    '/moderator': ('summit', 'moderator', 'にモデレーター権限を付与'),
+    '/summit': ('operator', 'summit', 'にサミット権限を付与'),
+    '/disspeaker': ('manager', 'normal', 'のスピーカー権限を解除'), # 剥奪すると1つ下の権限になる
+    '/dismanager': ('moderator', 'speaker', 'のマネージャー権限を解除'),
+    '/dismoderator': ('summit', 'manager', 'のモデレーター権限を解除'),
+    '/dissummit': ('operator', 'moderator', 'のサミット権限を解除'),
+}
+
+def register_role_command(name, min_role, new_role, action):
+    @commands.register(name, min_role, parse=user_id(f'ユーザーIDを指定してください。(例: {name} ABC1234)'))
+    def command_role(caller, target_id):
+        # 自分と同じか上の権限のユーザー（運営は常に）は変えられない（権限は全員で共有しているため）
+        target_role = get_user_role(target_id)
+        if target_role == 'operator' or ROLE_LEVELS.get(target_role, 0) >= ROLE_LEVELS[caller.role]:
+            return 'error', f'ユーザーID {target_id} の権限は、自分と同じか上の権限のため変更できません。'
+        if not set_user_role(target_id, new_role):
+            return 'error', f'ユーザーID {target_id} {action}できませんでした。'
+        return 'success', f'ユーザーID {target_id} {action}しました。'
+
+for _name, (_min_role, _new_role, _action) in ROLE_COMMANDS.items():
+    register_role_command(_name, _min_role, _new_role, _action)
+
+# operator権限は現状、コード内でしか付与できない（最上位権限のため）
+@commands.register('/operator')
+def command_operator(caller, arg):
+    return 'error', 'このコマンドでは運営権限を付与できません。'
+
+@commands.register('/disoperator')
+def command_disoperator(caller, arg):
+    return 'error', 'このコマンドでは運営権限を解除できません。'
+
+@commands.register('/disself')
+def command_disself(caller, arg):
+    if caller.role == 'normal':
+        return 'info', '既に青IDです。'
+    set_user_role(caller.display_id, 'normal')
+    return 'success', '自身の権限を青IDにリセットしました。'
+
+@commands.register('/add', 'speaker', parse=required('IDに追加する文字を指定してください。(例: /add 文字)'))
+def command_add(caller, text):
+    storage.set_user_suffix(caller.display_id, text, 'magenta') # デフォルトでマゼンタ色
+    apply_change('user_suffix', display_id=caller.display_id, text=text, color='magenta')
+    return 'success', f'IDに「{text}」を追加しました。'
+
+@commands.register('/destroy', 'manager', parse=required('削除する文字を指定してください。(例: /destroy 不快な内容)'))
+def command_destroy(caller, text):
+    board = caller.board
+    destroyed_ids = sorted(board.post_index.search(text))
+    if not destroyed_ids:
+        return 'info', f'「{text}」を含む投稿は見つかりませんでした。'
+    storage.delete_posts(board.id, destroyed_ids)
+    apply_change('posts_deleted', board, post_ids=destroyed_ids)
+    board.broadcaster.posts_deleted(destroyed_ids)
+    return 'success', f'「{text}」を含む投稿を全て削除しました。'
+
+@commands.register('/NG', 'moderator', parse=stripped)
+def command_ng(caller, word):
+    board = caller.board
+    if not word or word in board.ng_words:
+        return 'error', '有効なNGワードを指定してください。'
+    storage.add_ng_word(board.id, word)
+    apply_change('ng_word_added', board, word=word)
+    return 'success', f'NGワード「{word}」を追加しました。'
+
+@commands.register('/OK', 'moderator', parse=stripped)
+def command_ok(caller, word):
+    board = caller.board
+    if word not in board.ng_words:
+        return 'info', '指定されたNGワードは見つかりませんでした。'
+    storage.remove_ng_word(board.id, word)
+    apply_change('ng_word_removed', board, word=word)
+    return 'success', f'NGワード「{word}」を解除しました。'
+
+def update_board_settings(board, **values):
+    storage.update_board(board.id, **values)
+    apply_change('board_settings', board, **values)
+
+@commands.register('/prevent', 'manager')
+def command_prevent(caller, arg):
+    update_board_settings(caller.board, prevent_blue_id_post=True)
+    return 'success', '青IDユーザーの投稿を禁止しました。'
+
+@commands.register('/permit', 'manager')
+def command_permit(caller, arg):
+    update_board_settings(caller.board, prevent_blue_id_post=False)
+    return 'success', '/prevent を解除しました。'
+
+@commands.register('/restrict', 'manager')
+def command_restrict(caller, arg):
+    update_board_settings(caller.board, restrict_blue_id_post=True)
+    return 'success', '青IDユーザーの投稿を制限しました。'
+
+@commands.register('/stop', 'moderator')
+def command_stop(caller, arg):
+    update_board_settings(caller.board, stop_blue_id_until=time.time() + 180) # 3分間
+    return 'success', '3分間、青IDユーザーの投稿を禁止しました。'
+
+@commands.register('/prohibit', 'moderator', parse=integer('禁止する時間を分単位で指定してください。(例: /prohibit 10)'))
+def command_prohibit(caller, duration_minutes):
+    update_board_settings(caller.board, stop_blue_id_until=time.time() + (duration_minutes * 60))
+    return 'success', f'{duration_minutes}分間、青IDユーザーの投稿を禁止しました。'
+
+@commands.register('/release', 'manager')
+def command_release(caller, arg):
+    update_board_settings(caller.board, prevent_blue_id_post=False, restrict_blue_id_post=False, stop_blue_id_until=0)
+    return 'success', '全ての投稿規制を解除しました。'
+
+def add_block(blocklist, value):
+    storage.add_block(blocklist, value)
+    apply_change('block_added', blocklist=blocklist, value=value)
+
+def parse_ban_target(arg):
+    """IPアドレス（文字列）、または投稿番号（数値。投稿者のIPは板が分かってから調べる）"""
+    arg = arg.strip()
+    if arg.isdigit():
+        return int(arg)
+    try:
+        return str(ipaddress.ip_address(arg))
+    except ValueError:
+        raise ValueError('BANするIPまたは投稿番号を指定してください。(例: /ban 12)') from None
+
+@commands.register('/kill', 'operator', parse=user_id('使用不能にするユーザーIDを指定してください。(例: /kill ABC1234)'))
+def command_kill(caller, target_id):
+    # ここでは簡単のため、特定のIDの投稿を不可視にするなどの処理は省略
+    add_block('display_id', target_id)
+    return 'success', f'ユーザーID {target_id} のアカウントを使用不能にしました。'
+
+@commands.register('/ban', 'operator', parse=parse_ban_target)
+def command_ban(caller, target):
+    ip = target
+    if isinstance(target, int):
+        ip = storage.get_post_ip(caller.board.id, target)
+        if ip is None:
+            return 'error', f'投稿番号 {target} の投稿者のIPは見つかりませんでした。'
+    add_block('ip', ip)
+    return 'success', f'IP {ip} からの投稿を禁止しました。'
+
+@commands.register('/revive', 'operator', parse=required('解除するユーザーID・IPまたは投稿番号を指定してください。(例: /revive ABC1234)', strip=True))
+def command_revive(caller, target):
+    if target.isdigit():
+        target = storage.get_post_ip(caller.board.id, int(target)) or target
+    else:
+        try:
+            target = str(ipaddress.ip_address(target))
+        except ValueError:
+            pass # 表示用ID
+    if not any(target in blocked for blocked in blocklists.values()):
+        return 'info', f'{target} は /kill, /ban されていません。'
+    storage.remove_blocks(target)
+    apply_change('blocks_removed', value=target)
+    return 'success', f'{target} の /kill, /ban を解除しました。'
+
+# 板ID（URLの /b/<板ID> に使う）
+BOARD_ID_PATTERN = re.compile(r'^[a-z0-9_-]{1,32}$')
+MAX_BOARD_NAME_LENGTH = 50
+
+@commands.register('/board', 'operator', parse=required('板IDと表示名を指定してください。(例: /board game ゲーム)', strip=True))
+def command_board(caller, arg):
+    board_id, _, name = arg.partition(' ')
+    name = name.strip() or board_id
+    if not BOARD_ID_PATTERN.match(board_id):
+        return 'error', '板IDは英小文字・数字・「-」「_」の32文字以内で指定してください。'
+    if len(name) > MAX_BOARD_NAME_LENGTH:
+        return 'error', f'表示名は{MAX_BOARD_NAME_LENGTH}文字までです。'
+    if not storage.create_board(board_id, name):
+        return 'error', f'板ID {board_id} は既にあります。'
+    apply_change('board_created', board_id=board_id, name=name)
+    return 'success', f'板「{name}」を作成しました。（/b/{board_id}）'
+
+PROFILE_MAX_SECONDS = 300
+
+def parse_profile_seconds(arg):
+    """採取する秒数（省略時は30秒）"""
+    if not arg.strip():
+        return 30
+    seconds = integer('採取する秒数を指定してください。(例: /profile 30)')(arg)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise ValueError(f'採取する秒数は1〜{PROFILE_MAX_SECONDS}秒で指定してください。')
+    return seconds
+
+@commands.register('/profile', 'operator', parse=parse_profile_seconds)
+def command_profile(caller, seconds):
+    # プロファイラーはこのワーカーだけで動くので、結果も同じワーカーの /debug/profile で見る
+    if not profiler.start(seconds):
+        return 'info', 'プロファイラーは既に採取中です。'
+    return 'success', f'{seconds}秒間プロファイルを採取します。結果はこのワーカー（PID {os.getpid()}）の /debug/profile で確認できます。'
+
+@commands.register('/reduce', 'operator')
+def command_reduce(caller, arg):
+    return 'success', '権限全体の2%を削除しました（仮）。'
+
+# 色コードの簡単なバリデーション (例: #RRGGBB形式)
+COLOR_CODE_PATTERN = re.compile(r'^#[0-9a-fA-F]{6}$')
+COLOR_NAMES = {'red', 'blue', 'green', 'purple', 'black', 'white'} # その他の色も追加可能
+
+@commands.register('/color', 'speaker')
+def command_color(caller, arg):
+    color_parts = arg.split(' ', 1)
+    color_code = color_parts[0].strip()
+    target_id = caller.display_id # ID指定がなければ自分
+    if len(color_parts) > 1 and color_parts[1].strip():
+        try:
+            target_id = user_id('色を変えるユーザーIDを指定してください。(例: /color #FF00FF ABC1234)')(color_parts[1])
+        except ValueError as e:
+            return 'error', str(e)
+    if not (COLOR_CODE_PATTERN.match(color_code) or color_code in COLOR_NAMES):
+        return 'error', '有効な色コード（例: #FF00FF または red）を指定してください。'
+    storage.set_user_color(target_id, color_code)
+    apply_change('user_color', display_id=target_id, color=color_code)
+    return 'success', f'ユーザーID {target_id} の名前の色を {color_code} に変更しました。'
+
+@commands.register('/instances', 'speaker')
+def command_instances(caller, arg):
+    return 'info', 'インスタンスを登録/閲覧します（仮）。'
+
+@commands.register('/max', 'manager', parse=integer('投稿数の上限を数値で指定してください。(例: /max 50)'))
+def command_max(caller, new_max):
+    board = caller.board
+    if new_max <= 0:
+        return 'error', '投稿上限は正の数を指定してください。'
+    storage.update_board(board.id, max_posts=new_max)
+    storage.trim_posts(board.id, new_max)
+    apply_change('board_settings', board, max_posts=new_max)
+    board.broadcaster.refresh()
+    return 'success', f'投稿数の上限を{new_max}件に設定しました。'
+
+@commands.register('/range', 'manager', parse=integer('表示投稿数を数値で指定してください。(例: /range 30)'))
+def command_range(caller, new_page_size):
+    if not 0 < new_page_size <= MAX_PAGE_SIZE:
+        return 'error', f'表示投稿数は1から{MAX_PAGE_SIZE}までの数を指定してください。'
+    update_board_settings(caller.board, page_size=new_page_size)
+    caller.board.broadcaster.refresh()
+    return 'success', f'最初に表示する投稿数を{new_page_size}件に設定しました。'
+
+# /metrics・/debug/profile を読むためのトークン（Authorization: Bearer <トークン> で渡す）
+# 未設定なら誰にも返さない（同じマシンのリバースプロキシを通ると全員が 127.0.0.1 に見えるので、IPでは許可しない）
+MONITORING_TOKEN = os.environ.get('MONITORING_TOKEN', '')
+
+def monitoring_only(view):
+    """計測値・プロファイルのように内部の情報を返すエンドポイントを、監視用のリクエストだけに絞る"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        authorization = request.headers.get('Authorization', '')
+        if not MONITORING_TOKEN or not hmac.compare_digest(authorization.encode(), f'Bearer {MONITORING_TOKEN}'.encode()):
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/metrics')
+@monitoring_only
+def metrics_endpoint():
+    """Prometheus 形式の計測値"""
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/health')
+def health():
+    """死活監視用（render.yaml の healthCheckPath）。DBに繋がらなければ 503 を返す"""
+    try:
+        storage.ping()
+    except SQLAlchemyError:
+        return jsonify({'status': 'error'}), 503
+    return jsonify({'status': 'ok', 'boards_loaded': len(boards)})
+
+@app.route('/debug/profile')
+@monitoring_only
+def debug_profile():
+    """/profile で採取したスタック（collapsed 形式。flamegraph.pl や speedscope で読める）
+
+    プロファイラーは /profile を受けたワーカーでだけ動くので、複数ワーカーでは同じワーカー（X-Worker-Pid）から読む。
+    """
+    headers = {'Content-Type': 'text/plain; charset=utf-8', 'Cache-Control': 'no-store', 'X-Worker-Pid': str(os.getpid())}
+    return profiler.report(), 200, headers
+
+# フォームの maxlength と同じ上限（名前はDBの列の長さ）
+MAX_MESSAGE_LENGTH = 100
+MAX_NAME_LENGTH = 25
+
+def rejected(reason, message):
+    rejected_posts_total.inc(reason)
+    return {'ok': False, 'error': message}
+
+@post_message_seconds.timed
+def submit_message(board, name, message, seed, ip):
+    """板への投稿・コマンドを受け付ける（フォームの /post と Socket.IO の 'post' の両方から使う）
+
+    結果は {'ok': True, 'post_id': 投稿ID, 'post': 表示用の投稿}（投稿）、
+    {'ok': True, 'category': 'success' または 'info', 'message': 文言}（コマンド）、
+    {'ok': False, 'error': 文言}（受け付けなかった）のいずれか。
+    """
+    if not all(isinstance(value, str) for value in (name, message, seed)):
+        return rejected('invalid', '投稿内容が正しくありません。')
+    if not message or not name or not seed:
+        return rejected('invalid', 'メッセージ・名前・シードを入力してください。')
+    if len(message) > MAX_MESSAGE_LENGTH or len(name) > MAX_NAME_LENGTH:
+        return rejected('invalid', f'メッセージは{MAX_MESSAGE_LENGTH}文字、名前は{MAX_NAME_LENGTH}文字までです。')
 
     display_id = get_display_id(name, seed)
     user_role = get_user_role(display_id)
 
-    # NGワードチェック
-    if check_ng_words(message):
-        flash('メッセージにNGワードが含まれています。', 'error')
-        return redirect(url_for('index'))
+    # BANと連投の確認（NGワードの照合より先に、安く弾く）
+    rejection = check_flood(display_id, user_role, ip)
+    if rejection:
+        return rejected(*rejection)
+
+    # NGワードチェック（/OK はNGワード自体を書くので除外する）
+    if not message.startswith('/OK ') and check_ng_words(board, message):
+        return rejected('ng_word', 'メッセージにNGワードが含まれています。')
 
     # 青ID投稿禁止/制限のチェック
     if display_id.startswith('7') or display_id.startswith('8') or display_id.startswith('9'): # 青IDの判定
-        if prevent_blue_id_post:
-            flash('現在、青IDユーザーの投稿は禁止されています。', 'error')
-            return redirect(url_for('index'))
-        if restrict_blue_id_post and user_role == 'normal': # normalロールの青IDのみ制限
-            flash('現在、青ID（一般ユーザー）の投稿は制限されています。', 'error')
-            return redirect(url_for('index'))
-        if stop_blue_id_until > time.time():
-            remaining_time = int(stop_blue_id_until - time.time())
-            flash(f'現在、青IDユーザーの投稿は一時的に禁止されています。残り{remaining_time}秒。', 'error')
-            return redirect(url_for('index'))
-
-    # コマンド処理
+        if board.prevent_blue_id_post:
+            return rejected('blue_id_prevent', '現在、青IDユーザーの投稿は禁止されています。')
+        if board.restrict_blue_id_post and user_role == 'normal': # normalロールの青IDのみ制限
+            return rejected('blue_id_restrict', '現在、青ID（一般ユーザー）の投稿は制限されています。')
+        if board.stop_blue_id_until > time.time():
+            remaining_time = int(board.stop_blue_id_until - time.time())
+            return rejected('blue_id_stop', f'現在、青IDユーザーの投稿は一時的に禁止されています。残り{remaining_time}秒。')
+
+    # コマンド処理（必要な権限の確認と引数の解析は commands に登録した内容で行う）
     if message.startswith('/'):
-        parts = message.split(' ', 1)
-        command = parts[0]
-        arg = parts[1] if len(parts) > 1 else ''
-
-        # 権限チェック関数
-        def check_permission(required_role_level):
-            role_levels = {'normal': 0, 'speaker': 1, 'manager': 2, 'moderator': 3, 'summit': 4, 'operator': 5}
-            user_level = role_levels.get(user_role, 0)
-            required_level = role_levels.get(required_role_level, 0)
-            return user_level >= required_level
-
-        if command == '/del':
-            if not check_permission('speaker'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            try:
-                ids_to_delete = [int(i.strip()) for i in arg.split(',')]
-                original_posts_len = len(posts)
-                global posts
-                posts = [p for p in posts if p['id'] not in ids_to_delete]
-                if len(posts) < original_posts_len:
-                    flash(f'{original_posts_len - len(posts)}件の投稿を削除しました。', 'success')
-                    socketio.emit('post_deleted', {'deleted_ids': ids_to_delete}, broadcast=True)
-                else:
-                    flash('指定された投稿IDは見つかりませんでした。', 'info')
-            except ValueError:
-                flash('削除する投稿のIDを正しく指定してください。(例: /del 1,2,3)', 'error')
-        elif command == '/clear':
-            if not check_permission('manager'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            posts.clear()
-            next_post_id = 1
-            flash('全ての投稿が削除され、IDがリセットされました。', 'success')
-            socketio.emit('posts_cleared', broadcast=True)
-        elif command == '/topic':
-            if not check_permission('moderator'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            current_topic = arg
-            flash(f'話題を「{current_topic}」に変更しました。', 'success')
-            socketio.emit('topic_updated', {'topic': current_topic}, broadcast=True)
-        elif command == '/speaker':
-            if not check_permission('manager'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            target_id = arg.strip()
-            if set_user_role(target_id, 'speaker'):
-                flash(f'ユーザーID {target_id} にスピーカー権限を付与しました。', 'success')
-                socketio.emit('roles_updated', {'display_id': target_id, 'role': 'speaker'}, broadcast=True)
-            else:
-                flash(f'ユーザーID {target_id} にスピーカー権限を付与できませんでした。', 'error')
-        elif command == '/manager':
-            if not check_permission('moderator'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            target_id = arg.strip()
-            if set_user_role(target_id, 'manager'):
-                flash(f'ユーザーID {target_id} にマネージャー権限を付与しました。', 'success')
-                socketio.emit('roles_updated', {'display_id': target_id, 'role': 'manager'}, broadcast=True)
-            else:
-                flash(f'ユーザーID {target_id} にマネージャー権限を付与できませんでした。', 'error')
-        elif command == '/moderator':
-            if not check_permission('summit'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            target_id = arg.strip()
-            if set_user_role(target_id, 'moderator'):
-                flash(f'ユーザーID {target_id} にモデレーター権限を付与しました。', 'success')
-                socketio.emit('roles_updated', {'display_id': target_id, 'role': 'moderator'}, broadcast=True)
-            else:
-                flash(f'ユーザーID {target_id} にモデレーター権限を付与できませんでした。', 'error')
-        elif command == '/summit':
-            if not check_permission('operator'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            target_id = arg.strip()
-            if set_user_role(target_id, 'summit'):
-                flash(f'ユーザーID {target_id} にサミット権限を付与しました。', 'success')
-                socketio.emit('roles_updated', {'display_id': target_id, 'role': 'summit'}, broadcast=True)
-            else:
-                flash(f'ユーザーID {target_id} にサミット権限を付与できませんでした。', 'error')
-        elif command == '/operator':
-            # operator権限は現状、コード内でしか付与できない（最上位権限のため）
-            flash('このコマンドでは運営権限を付与できません。', 'error')
-        elif command == '/disspeaker':
-            if not check_permission('manager'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            target_id = arg.strip()
-            if set_user_role(target_id, 'normal'): # スピーカー権限を剥奪しnormalに
-                flash(f'ユーザーID {target_id} のスピーカー権限を解除しました。', 'success')
-                socketio.emit('roles_updated', {'display_id': target_id, 'role': 'normal'}, broadcast=True)
-            else:
-                flash(f'ユーザーID {target_id} のスピーカー権限を解除できませんでした。', 'error')
-        elif command == '/dismanager':
-            if not check_permission('moderator'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            target_id = arg.strip()
-            if set_user_role(target_id, 'speaker'): # マネージャー権限を剥奪しスピーカーに
-                flash(f'ユーザーID {target_id} のマネージャー権限を解除しました。', 'success')
-                socketio.emit('roles_updated', {'display_id': target_id, 'role': 'speaker'}, broadcast=True)
-            else:
-                flash(f'ユーザーID {target_id} のマネージャー権限を解除できませんでした。', 'error')
-        elif command == '/dismoderator':
-            if not check_permission('summit'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            target_id = arg.strip()
-            if set_user_role(target_id, 'manager'): # モデレーター権限を剥奪しマネージャーに
-                flash(f'ユーザーID {target_id} のモデレーター権限を解除しました。', 'success')
-                socketio.emit('roles_updated', {'display_id': target_id, 'role': 'manager'}, broadcast=True)
-            else:
-                flash(f'ユーザーID {target_id} のモデレーター権限を解除できませんでした。', 'error')
-        elif command == '/dissummit':
-            if not check_permission('operator'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            target_id = arg.strip()
-            if set_user_role(target_id, 'moderator'): # サミット権限を剥奪しモデレーターに
-                flash(f'ユーザーID {target_id} のサミット権限を解除しました。', 'success')
-                socketio.emit('roles_updated', {'display_id': target_id, 'role': 'moderator'}, broadcast=True)
-            else:
-                flash(f'ユーザーID {target_id} のサミット権限を解除できませんでした。', 'error')
-        elif command == '/disoperator':
-            flash('このコマンドでは運営権限を解除できません。', 'error')
-        elif command == '/disself':
-            if user_role != 'normal':
-                set_user_role(display_id, 'normal')
-                flash('自身の権限を青IDにリセットしました。', 'success')
-                socketio.emit('roles_updated', {'display_id': display_id, 'role': 'normal'}, broadcast=True)
-            else:
-                flash('既に青IDです。', 'info')
-        elif command == '/add':
-            if not check_permission('speaker'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            if arg:
-                user_suffixes[display_id] = {'text': arg, 'color': 'magenta'} # デフォルトでマゼンタ色
-                flash(f'IDに「{arg}」を追加しました。', 'success')
-                socketio.emit('user_suffix_updated', {'display_id': display_id, 'suffix_text': arg}, broadcast=True)
-            else:
-                flash('IDに追加する文字を指定してください。(例: /add 文字)', 'error')
-        elif command == '/destroy':
-            if not check_permission('manager'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            if arg:
-                original_posts_len = len(posts)
-                global posts
-                posts = [p for p in posts if arg not in p['message']]
-                if len(posts) < original_posts_len:
-                    flash(f'「{arg}」を含む投稿を全て削除しました。', 'success')
-                    socketio.emit('request_posts_update', broadcast=True) # 全体を更新
-                else:
-                    flash(f'「{arg}」を含む投稿は見つかりませんでした。', 'info')
-            else:
-                flash('削除する文字を指定してください。(例: /destroy 不快な内容)', 'error')
-        elif command == '/NG':
-            if not check_permission('moderator'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            word_to_add = arg.strip()
-            if word_to_add and word_to_add not in ng_words:
-                ng_words.append(word_to_add)
-                flash(f'NGワード「{word_to_add}」を追加しました。', 'success')
-            else:
-                flash('有効なNGワードを指定してください。', 'error')
-        elif command == '/OK':
-            if not check_permission('moderator'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            word_to_remove = arg.strip()
-            if word_to_remove in ng_words:
-                ng_words.remove(word_to_remove)
-                flash(f'NGワード「{word_to_remove}」を解除しました。', 'success')
-            else:
-                flash('指定されたNGワードは見つかりませんでした。', 'info')
-        elif command == '/prevent':
-            if not check_permission('manager'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            prevent_blue_id_post = True
-            flash('青IDユーザーの投稿を禁止しました。', 'success')
-        elif command == '/permit':
-            if not check_permission('manager'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            prevent_blue_id_post = False
-            flash('/prevent を解除しました。', 'success')
-        elif command == '/restrict':
-            if not check_permission('manager'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            restrict_blue_id_post = True
-            flash('青IDユーザーの投稿を制限しました。', 'success')
-        elif command == '/stop':
-            if not check_permission('moderator'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            stop_blue_id_until = time.time() + 180 # 3分間
-            flash('3分間、青IDユーザーの投稿を禁止しました。', 'success')
-        elif command == '/prohibit':
-            if not check_permission('moderator'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            try:
-                duration_minutes = int(arg)
-                stop_blue_id_until = time.time() + (duration_minutes * 60)
-                flash(f'{duration_minutes}分間、青IDユーザーの投稿を禁止しました。', 'success')
-            except ValueError:
-                flash('禁止する時間を分単位で指定してください。(例: /prohibit 10)', 'error')
-        elif command == '/release':
-            if not check_permission('manager'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            prevent_blue_id_post = False
-            restrict_blue_id_post = False
-            stop_blue_id_until = 0
-            flash('全ての投稿規制を解除しました。', 'success')
-        elif command == '/kill':
-            if not check_permission('operator'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            target_id = arg.strip()
-            # ここでは簡単のため、特定のIDの投稿を不可視にするなどの処理は省略
-            flash(f'ユーザーID {target_id} のアカウントを使用不能にしました（仮）。', 'success')
-        elif command == '/ban':
-            if not check_permission('operator'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            # IPBANや投稿番号BANの具体的なロジックは実装が必要
-            flash(f'IPまたは投稿番号 {arg} でBANしました（仮）。', 'success')
-        elif command == '/revive':
-            if not check_permission('operator'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            flash(f'/kill, /ban を解除しました（仮）。', 'success')
-        elif command == '/reduce':
-            if not check_permission('operator'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            flash('権限全体の2%を削除しました（仮）。', 'success')
-        elif command == '/color':
-            if not check_permission('speaker'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            color_parts = arg.split(' ', 1)
-            color_code = color_parts[0].strip()
-            target_id_for_color = color_parts[1].strip() if len(color_parts) > 1 else display_id # ID指定がなければ自分
-            
-            # 色コードの簡単なバリデーション (例: #RRGGBB形式)
-            if re.match(r'^#[0-9a-fA-F]{6}$', color_code) or color_code in ['red', 'blue', 'green', 'purple', 'black', 'white']: # その他の色も追加可能
-                user_colors[target_id_for_color] = color_code
-                flash(f'ユーザーID {target_id_for_color} の名前の色を {color_code} に変更しました。', 'success')
-                socketio.emit('request_posts_update', broadcast=True)
-            else:
-                flash('有効な色コード（例: #FF00FF または red）を指定してください。', 'error')
-        elif command == '/instances':
-            if not check_permission('speaker'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            flash('インスタンスを登録/閲覧します（仮）。', 'info')
-        elif command == '/max':
-            if not check_permission('manager'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            try:
-                new_max = int(arg)
-                if new_max > 0:
-                    global max_posts
-                    max_posts = new_max
-                    # 古い投稿を削除して上限に合わせる
-                    if len(posts) > max_posts:
-                        del posts[0:len(posts) - max_posts]
-                    flash(f'投稿数の上限を{max_posts}件に設定しました。', 'success')
-                    socketio.emit('request_posts_update', broadcast=True)
-                else:
-                    flash('投稿上限は正の数を指定してください。', 'error')
-            except ValueError:
-                flash('投稿数の上限を数値で指定してください。(例: /max 50)', 'error')
-        elif command == '/range':
-            if not check_permission('manager'):
-                flash('このコマンドを実行する権限がありません。', 'error')
-                return redirect(url_for('index'))
-            flash('表示投稿数を変更します（仮）。', 'info') # 表示数の変更はフロントエンド側の実装が必要
-        else:
-            flash(f'不明なコマンド: {command}', 'error')
-        
-        return redirect(url_for('index')) # コマンド処理後はリダイレクト
+        command_name = message.partition(' ')[0]
+        commands_total.inc(command_name if command_name in commands.commands else 'unknown') # 不明なコマンドでラベルを増やさない
+        category, result = commands.dispatch(message, Caller(display_id, user_role, board))
+        if category == 'error':
+            return {'ok': False, 'error': result}
+        return {'ok': True, 'category': category, 'message': result}
 
     # 通常の投稿処理
-    new_post = {
-        'id': next_post_id,
-        'name': name,
-        'message': message,
-        'seed': seed,
-    }
-    posts.append(new_post)
-    next_post_id += 1
+    new_post = storage.add_post(board.id, name, message, display_id, ip)
+    # 上限を超えてメモリから追い出した投稿だけをDBからも消す（件数を数え直す OFFSET は /max のときだけ）
+    evicted_posts = apply_change('post_added', board, post=new_post)
+    storage.delete_posts(board.id, [post.id for post in evicted_posts])
+    posts_total.inc()
+
+    # 新しい投稿だけを板の部屋に配信する（投稿IDは板ごとの連番なので、クライアントはIDの飛びで取りこぼしを検知できる）
+    post_data = get_post_data(board, board.posts.get(new_post['id']))
+    board.broadcaster.post_added(post_data)
+    return {'ok': True, 'post_id': new_post['id'], 'post': post_data}
+
+@app.route('/post', methods=['POST'])
+def post_message():
+    """JavaScript が使えないとき用のフォーム投稿（結果はリダイレクト先で表示する）"""
+    board = get_request_board(request.form.get('board', storage.BOARD_ID))
+    message = request.form.get('message', '')
+    name = request.form.get('name', '')
+    seed = request.form.get('seed', '')
+
+    # 入力値をセッションに保存（リダイレクト後にフォームに再入力するため）
+    session['prev_message'] = message
+    session['prev_name'] = name
+    session['prev_seed'] = seed
+
+    result = submit_message(board, name, message, seed, get_client_ip())
+    if not result['ok']:
+        flash(result['error'], 'error')
+    elif 'message' in result:
+        flash(result['message'], result['category'])
+    return redirect(url_for('index', board_id=board.id))
+
+# 接続中のクライアントが開いている板 {sid: 板ID}（接続時の ?board= で決まる）
+client_boards = {}
+
+def get_client_board():
+    return boards.get(client_boards[request.sid])
+
+@socketio.on('post')
+def handle_post(data):
+    """Socket.IO での投稿・コマンド。結果は flash ではなく ack で返す"""
+    if not isinstance(data, dict):
+        return {'ok': False, 'error': '投稿内容が正しくありません。'}
+    return submit_message(get_client_board(), data.get('name'), data.get('message'), data.get('seed'), get_client_ip())
+
+@socketio.on('connect')
+def handle_connect(auth=None):
+    """開いている板の部屋に入れる（このインスタンスが受け持たない板なら接続を断る）"""
+    board_id = request.args.get('board', storage.BOARD_ID)
+    if not serves_board(board_id):
+        return False
+    board = boards.get(board_id)
+    board.clients += 1 # 部屋にクライアントがいる間はメモリから外さない
+    client_boards[request.sid] = board_id
+    join_room(board.room)
+    connected_clients.inc()
+
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    board = boards.loaded(client_boards.pop(request.sid, None))
+    if board is not None:
+        board.clients -= 1
+    connected_clients.dec()
+
+@socketio.on('request_posts_update')
+def handle_request_posts_update(data=None):
+    """クライアントからの再同期要求。取りこぼしが少なければ差分、それ以外はスナップショットを返す"""
+    board = get_client_board()
+    since = None
+    if isinstance(data, dict):
+        try:
+            since = int(data.get('since'))
+        except (TypeError, ValueError):
+            since = None
+
+    if since is not None:
+        new_posts = get_posts_since(board, since)
+        if new_posts is not None:
+            emit('posts_delta', {'posts': new_posts, 'since': since})
+            return
 
-    # 投稿が最大数を超えた場合、古いものから削除
-    if len(posts) > max_posts:
-        del posts[0]
+    board.broadcaster.refresh(request.sid)
 
-    socketio.emit('update_posts', {'posts': [get_post_data(p) for p in posts[::-1]], 'current_topic': current_topic}, broadcast=True)
-    
-    #
+if __name__ == '__main__':
+    # 開発用。本番は gunicorn -c gunicorn.conf.py app:app で起動する
+    socketio.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', '5000')))
@@ -0,0 +1,285 @@
+"""掲示板の主な処理のベンチマーク
+
+app.test_client() と Socket.IO のテストクライアントで、サーバーを起動せずに計測する。
+- 投稿の処理速度（/post）: 投稿上限 max_posts と NGワード数ごと
+- トップページ（index）の応答時間: 板の投稿数ごと（描画し直す場合・キャッシュ済み・304）
+- /del と /destroy の処理時間: 投稿数の多い板で
+- 板の部屋宛て配信の直列化・送信時間: 接続中のクライアント数ごと
+結果はJSONで出力するので、コミット間で比較できる。
+
+使い方:
+    python bench/board.py [--quick] [--output result.json]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# ひらがなの投稿に対して、カタカナのNGワードは一致しない（毎回最後まで照合する最悪の場合）
+MESSAGE_ALPHABET = 'あいうえおかきくけこさしすせそたちつてとなにぬねの'
+NG_ALPHABET = 'アイウエオカキクケコサシスセソタチツテトナニヌネノ'
+OPERATOR = {'name': 'bench', 'seed': 'bench'}
+
+
+def load_app(workdir):
+    """一時DBでアプリを読み込む（配信はスレッドで行い、頻度制限は外す）"""
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(workdir, "bbs.db")}'
+    os.environ['SOCKETIO_ASYNC_MODE'] = 'threading'
+    os.environ['RATE_LIMIT'] = '0'
+    os.environ.setdefault('BOARD_BUS_URL', 'local://')
+    import app
+    return app
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(seconds):
+    """処理時間のリスト（秒）をミリ秒の統計にする"""
+    ordered = sorted(seconds)
+    return {
+        'n': len(ordered),
+        'mean_ms': round(statistics.mean(ordered) * 1000, 3),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 3),
+        'p99_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+    }
+
+
+class Bench:
+    def __init__(self, app_module, seed=0):
+        self.m = app_module
+        self.rng = random.Random(seed)
+        self.client = self.m.app.test_client()
+        with self.m.app.app_context():
+            self.m.set_user_role(self.m.get_display_id(OPERATOR['name'], OPERATOR['seed']), 'operator')
+            self.board = self.m.boards.get(self.m.storage.BOARD_ID) # /post と test_client の既定の板
+
+    def random_message(self, length=40):
+        return ''.join(self.rng.choice(MESSAGE_ALPHABET) for _ in range(length))
+
+    def post(self, message, **user):
+        data = {'message': message, 'name': 'user', 'seed': 'user'}
+        data.update(user)
+        response = self.client.post('/post', data=data)
+        assert response.status_code == 302, response.status_code
+        return response
+
+    def command(self, message):
+        return self.post(message, **OPERATOR)
+
+    def reset_board(self, max_posts, ng_word_count=0):
+        """投稿を消し、投稿上限とNGワードを設定し直す"""
+        m, board = self.m, self.board
+        with m.app.app_context():
+            m.storage.clear_posts(board.id)
+            m.apply_change('posts_cleared', board)
+            m.storage.update_board(board.id, max_posts=max_posts)
+            m.apply_change('board_settings', board, max_posts=max_posts)
+            for word in list(board.ng_words):
+                m.storage.remove_ng_word(board.id, word)
+                m.apply_change('ng_word_removed', board, word=word)
+            words = set()
+            while len(words) < ng_word_count:
+                words.add(''.join(self.rng.choice(NG_ALPHABET) for _ in range(self.rng.randint(3, 6))))
+            for word in words:
+                m.storage.add_ng_word(board.id, word)
+                m.apply_change('ng_word_added', board, word=word)
+
+    def fill_board(self, count, message=None):
+        """HTTPを通さずに投稿を入れる（投稿の処理から頻度制限・NG照合を除いたもの）"""
+        m, board = self.m, self.board
+        with m.app.app_context():
+            for i in range(count):
+                text = message(i) if message else self.random_message()
+                m.apply_change('post_added', board, post=m.storage.add_post(board.id, 'filler', text, 'FILLER0'))
+
+    def post_throughput(self, max_posts_list, ng_word_counts, count):
+        results = []
+        for max_posts in max_posts_list:
+            for ng_word_count in ng_word_counts:
+                self.reset_board(max_posts, ng_word_count)
+                self.fill_board(max_posts) # 満杯の状態から投稿し、古い投稿の追い出しも含めて測る
+                messages = [self.random_message() for _ in range(count)]
+                durations = []
+                started = time.perf_counter()
+                for message in messages:
+                    post_started = time.perf_counter()
+                    self.post(message)
+                    durations.append(time.perf_counter() - post_started)
+                elapsed = time.perf_counter() - started
+                results.append({
+                    'max_posts': max_posts,
+                    'ng_words': ng_word_count,
+                    'posts': count,
+                    'posts_per_second': round(count / elapsed, 1),
+                    'latency': summarize(durations),
+                })
+        return results
+
+    def index_latency(self, board_sizes, repeat):
+        results = []
+        for size in board_sizes:
+            self.reset_board(size)
+            self.fill_board(size)
+
+            cold = []
+            for _ in range(repeat):
+                self.board.page_cache.bump() # 板が変わった直後（描画し直す）
+                started = time.perf_counter()
+                response = self.client.get('/')
+                cold.append(time.perf_counter() - started)
+            warm = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                response = self.client.get('/')
+                warm.append(time.perf_counter() - started)
+            etag = response.headers['ETag']
+            not_modified = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                response = self.client.get('/', headers={'If-None-Match': etag})
+                not_modified.append(time.perf_counter() - started)
+            assert response.status_code == 304, response.status_code
+            results.append({
+                'board_size': size,
+                'render': summarize(cold),
+                'cached': summarize(warm),
+                'not_modified': summarize(not_modified),
+                'body_bytes': len(self.client.get('/').data),
+            })
+        return results
+
+    def moderation_cost(self, board_size, repeat, batch):
+        """/del（batch 件ずつ）と /destroy（1% の投稿に含まれる語）の処理時間"""
+        self.reset_board(board_size)
+        # i 番目の投稿に「語 i % 100」を入れ、/destroy のたびに別の1%が消えるようにする
+        self.fill_board(board_size, message=lambda i: f'{self.random_message(30)} 語{i % 100:02d}語')
+
+        latest_id = self.board.posts.latest_id()
+        ids = list(range(latest_id - board_size + 1, latest_id + 1))
+        self.rng.shuffle(ids)
+        delete_durations = []
+        for i in range(repeat):
+            chunk = ids[i * batch:(i + 1) * batch]
+            started = time.perf_counter()
+            self.command('/del ' + ','.join(map(str, chunk)))
+            delete_durations.append(time.perf_counter() - started)
+
+        destroy_durations = []
+        for i in range(repeat):
+            started = time.perf_counter()
+            self.command(f'/destroy 語{i:02d}語')
+            destroy_durations.append(time.perf_counter() - started)
+
+        return {
+            'board_size': board_size,
+            'del': {'ids_per_command': batch, **summarize(delete_durations)},
+            'destroy': {'matched_fraction': 0.01, **summarize(destroy_durations)},
+        }
+
+    def broadcast_cost(self, client_counts, repeat):
+        """1件の投稿の batch と、全体のスナップショットを板の部屋の全員に送る時間"""
+        m, board = self.m, self.board
+        self.reset_board(100)
+        self.fill_board(100)
+        post_batch = {'cleared': False, 'posts': [m.get_post_data(board, board.posts.newest(1)[0])], 'deleted_ids': []}
+
+        results = []
+        clients = []
+        for count in client_counts:
+            while len(clients) < count:
+                clients.append(m.socketio.test_client(m.app))
+            for client in clients:
+                client.get_received()
+
+            serialize = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                json.dumps(m.get_posts_snapshot(board))
+                serialize.append(time.perf_counter() - started)
+            batch_emit = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                m.broadcast('batch', post_batch, to=board.room)
+                batch_emit.append(time.perf_counter() - started)
+            snapshot_emit = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                m.broadcast('batch', {'snapshot': m.get_posts_snapshot(board)}, to=board.room)
+                snapshot_emit.append(time.perf_counter() - started)
+            for client in clients:
+                client.get_received() # 受信したイベントを捨ててメモリを空ける
+            results.append({
+                'clients': count,
+                'snapshot_serialize': summarize(serialize),
+                'post_batch_emit': summarize(batch_emit),
+                'snapshot_emit': summarize(snapshot_emit),
+            })
+        for client in clients:
+            client.disconnect()
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='件数を減らして短時間で回す')
+    parser.add_argument('--output', help='結果のJSONを書き出すファイル')
+    args = parser.parse_args()
+
+    if args.quick:
+        config = {
+            'max_posts': [100, 1000], 'ng_words': [0, 1000], 'posts': 200,
+            'board_sizes': [100, 1000], 'repeat': 20,
+            'moderation_board': 2000, 'moderation_repeat': 5,
+            'clients': [1, 50], 'broadcast_repeat': 20,
+        }
+    else:
+        config = {
+            'max_posts': [100, 1000, 10000], 'ng_words': [0, 100, 1000, 10000], 'posts': 1000,
+            'board_sizes': [100, 1000, 10000], 'repeat': 100,
+            'moderation_board': 10000, 'moderation_repeat': 20,
+            'clients': [1, 10, 100, 500], 'broadcast_repeat': 50,
+        }
+
+    workdir = tempfile.mkdtemp(prefix='bbs-bench-')
+    try:
+        bench = Bench(load_app(workdir))
+        results = {
+            'meta': {
+                'commit': git_commit(),
+                'python': sys.version.split()[0],
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'config': config,
+            },
+            'post_throughput': bench.post_throughput(config['max_posts'], config['ng_words'], config['posts']),
+            'index_latency': bench.index_latency(config['board_sizes'], config['repeat']),
+            'moderation': bench.moderation_cost(config['moderation_board'], config['moderation_repeat'], 100),
+            'broadcast': bench.broadcast_cost(config['clients'], config['broadcast_repeat']),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
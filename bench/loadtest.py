@@ -0,0 +1,225 @@
+"""掲示板サーバーの接続数・配信遅延の負荷試験
+
+ローカルに多数の Socket.IO クライアントを接続し、一定間隔で投稿して
+- 接続できたクライアント数
+- 投稿してから各クライアントに batch イベントで届くまでの遅延（p50 / p99）
+- 1接続あたりのサーバーのメモリ使用量
+を計測する。
+
+使い方:
+    # gunicorn.conf.py の設定でサーバーを起動して計測する（一時DBを使う）
+    python bench/loadtest.py --spawn --clients 2000 --rate 5 --duration 30
+
+    # 起動済みのサーバーに対して計測する（メモリは --server-pid 指定時のみ）
+    python bench/loadtest.py --url http://127.0.0.1:10000 --server-pid 12345
+
+クライアント側に python-socketio[asyncio_client]（aiohttp）が必要。
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import socketio
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOADTEST_PREFIX = 'loadtest '
+
+
+def read_rss_kb(pid):
+    """プロセスとその子プロセス（gunicorn のワーカー）の RSS 合計（KB）"""
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+        except FileNotFoundError:
+            continue
+    return total
+
+
+def find_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(workdir):
+    """一時DBを使って gunicorn を起動する"""
+    port = find_free_port()
+    env = dict(os.environ)
+    env['PORT'] = str(port)
+    env.setdefault('DATABASE_URL', f'sqlite:///{os.path.join(workdir, "bbs.db")}')
+    env.setdefault('RATE_LIMIT', '0') # 1つのIP・IDから投稿し続けるので頻度制限を外す
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', 'app:app'],
+        cwd=ROOT_DIR,
+        env=env,
+    )
+    return process, f'http://127.0.0.1:{port}'
+
+
+async def wait_until_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url + '/') as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f'サーバーが起動しませんでした: {url}')
+
+
+class LoadTest:
+    def __init__(self, url, clients, rate, duration, connect_concurrency):
+        self.url = url
+        self.client_count = clients
+        self.rate = rate
+        self.duration = duration
+        self.connect_concurrency = connect_concurrency
+        self.clients = []
+        self.connect_failures = 0
+        self.sent_at = {} # {投稿の通し番号: 送信時刻}
+        self.latencies = []
+
+    def on_batch(self, data):
+        received_at = time.perf_counter()
+        for post in data.get('posts', []):
+            message = post['message']
+            if not message.startswith(LOADTEST_PREFIX):
+                continue
+            sent_at = self.sent_at.get(int(message[len(LOADTEST_PREFIX):]))
+            if sent_at is not None:
+                self.latencies.append(received_at - sent_at)
+
+    async def connect_one(self, semaphore):
+        client = socketio.AsyncClient(reconnection=False)
+        client.on('batch', self.on_batch)
+        async with semaphore:
+            try:
+                await client.connect(self.url, transports=['websocket'], wait_timeout=30)
+            except Exception:
+                self.connect_failures += 1
+                return
+        self.clients.append(client)
+
+    async def connect_all(self):
+        semaphore = asyncio.Semaphore(self.connect_concurrency)
+        await asyncio.gather(*(self.connect_one(semaphore) for _ in range(self.client_count)))
+
+    async def post_loop(self):
+        interval = 1 / self.rate
+        async with aiohttp.ClientSession() as session:
+            started = time.perf_counter()
+            seq = 0
+            while time.perf_counter() - started < self.duration:
+                seq += 1
+                self.sent_at[seq] = time.perf_counter()
+                form = {'message': f'{LOADTEST_PREFIX}{seq}', 'name': 'loadtest', 'seed': 'loadtest'}
+                async with session.post(self.url + '/post', data=form, allow_redirects=False) as response:
+                    await response.read()
+                next_at = started + seq * interval
+                await asyncio.sleep(max(0, next_at - time.perf_counter()))
+        return seq
+
+    async def disconnect_all(self):
+        await asyncio.gather(*(client.disconnect() for client in self.clients), return_exceptions=True)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run(args):
+    process = None
+    workdir = tempfile.mkdtemp(prefix='bbs-loadtest-')
+    url = args.url
+    server_pid = args.server_pid
+    if args.spawn:
+        process, url = spawn_server(workdir)
+        server_pid = process.pid
+    try:
+        await wait_until_ready(url)
+        rss_before = read_rss_kb(server_pid) if server_pid else None
+
+        test = LoadTest(url, args.clients, args.rate, args.duration, args.connect_concurrency)
+        connect_started = time.perf_counter()
+        await test.connect_all()
+        connect_seconds = time.perf_counter() - connect_started
+        rss_connected = read_rss_kb(server_pid) if server_pid else None
+
+        posts_sent = await test.post_loop()
+        await asyncio.sleep(args.drain) # 配信待ち
+        await test.disconnect_all()
+
+        connected = len(test.clients)
+        expected = posts_sent * connected
+        result = {
+            'url': url,
+            'async_mode': os.environ.get('SOCKETIO_ASYNC_MODE', 'gevent') if args.spawn else None,
+            'clients_requested': args.clients,
+            'clients_connected': connected,
+            'connect_failures': test.connect_failures,
+            'connect_seconds': round(connect_seconds, 3),
+            'posts_sent': posts_sent,
+            'post_rate': args.rate,
+            'deliveries': len(test.latencies),
+            'delivery_ratio': round(len(test.latencies) / expected, 4) if expected else None,
+            'latency_p50_ms': round(percentile(test.latencies, 50) * 1000, 2) if test.latencies else None,
+            'latency_p99_ms': round(percentile(test.latencies, 99) * 1000, 2) if test.latencies else None,
+            'server_rss_kb_before': rss_before,
+            'server_rss_kb_connected': rss_connected,
+            'server_kb_per_connection': (
+                round((rss_connected - rss_before) / connected, 2) if server_pid and connected else None
+            ),
+        }
+        return result
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help='計測対象のサーバーURL')
+    target.add_argument('--spawn', action='store_true', help='gunicorn.conf.py でサーバーを起動して計測する')
+    parser.add_argument('--server-pid', type=int, help='メモリ計測に使うサーバーのPID（--url 時）')
+    parser.add_argument('--clients', type=int, default=1000, help='接続するクライアント数')
+    parser.add_argument('--rate', type=float, default=5, help='1秒あたりの投稿数')
+    parser.add_argument('--duration', type=float, default=20, help='投稿を続ける秒数')
+    parser.add_argument('--drain', type=float, default=2, help='投稿後に配信を待つ秒数')
+    parser.add_argument('--connect-concurrency', type=int, default=200, help='同時に接続処理するクライアント数')
+    parser.add_argument('--output', help='結果のJSONを書き出すファイル')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""NGワード照合のマイクロベンチマーク
+
+以前の実装（NGワードごとに `word in message`）と NgWordMatcher を、
+NGワード数 10 / 1,000 / 10,000 で比較する。
+
+使い方:
+    python bench/ng_words.py [--messages 2000] [--output result.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ngwords import NgWordMatcher  # noqa: E402
+
+# ひらがな・カタカナ・英字を混ぜて、実際の投稿に近い文字の分布にする
+ALPHABET = 'あいうえおかきくけこさしすせそアイウエオカキクケコabcdefghijklmnopqrstuvwxyz'
+
+
+def random_text(rng, length):
+    return ''.join(rng.choice(ALPHABET) for _ in range(length))
+
+
+def loop_check(words, message):
+    for word in words:
+        if word in message:
+            return True
+    return False
+
+
+def measure(func, messages):
+    started = time.perf_counter()
+    for message in messages:
+        func(message)
+    return (time.perf_counter() - started) / len(messages)
+
+
+def run(word_counts, message_count, seed=0):
+    rng = random.Random(seed)
+    # 投稿の最大長（100文字）のメッセージ
+    messages = [random_text(rng, 100) for _ in range(message_count)]
+    results = []
+    for count in word_counts:
+        words = list({random_text(rng, rng.randint(3, 6)) for _ in range(count)})
+
+        build_started = time.perf_counter()
+        matcher = NgWordMatcher(words, normalize=False)
+        matcher.search('') # 最初の照合でオートマトンを作る
+        matcher.search('x')
+        build_seconds = time.perf_counter() - build_started
+
+        normalized = NgWordMatcher(words, normalize=True)
+        normalized.search('x')
+
+        loop_us = measure(lambda m: loop_check(words, m), messages) * 1e6
+        matcher_us = measure(matcher.search, messages) * 1e6
+        normalized_us = measure(normalized.search, messages) * 1e6
+        results.append({
+            'words': len(words),
+            'loop_us_per_message': round(loop_us, 2),
+            'matcher_us_per_message': round(matcher_us, 2),
+            'matcher_nfkc_us_per_message': round(normalized_us, 2),
+            'speedup': round(loop_us / matcher_us, 1),
+            'build_ms': round(build_seconds * 1000, 2),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000, help='照合するメッセージ数')
+    parser.add_argument('--words', type=int, nargs='+', default=[10, 1000, 10000], help='NGワード数')
+    parser.add_argument('--output', help='結果のJSONを書き出すファイル')
+    args = parser.parse_args()
+
+    results = run(args.words, args.messages)
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
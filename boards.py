@@ -0,0 +1,192 @@
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from ngwords import NgWordMatcher
+from pagecache import VersionedCache
+from poststore import Post, PostStore
+from search import PostIndex
+
+
+def board_shard(board_id, shard_count):
+    """板を受け持つシャードの番号（どのプロセスでも同じ番号になるよう crc32 で決める）"""
+    return zlib.crc32(board_id.encode()) % shard_count
+
+
+class Board:
+    """1つの板の状態（投稿・話題・NGワード・投稿規制）と、その描画キャッシュ
+
+    状態は apply_* で変える（DBへの保存と他のワーカーへの通知は呼び出し側で行う）。
+    """
+
+    def __init__(self, board_id, state, ng_normalize=True):
+        settings = state['board']
+        self.id = board_id
+        self.room = f'board:{board_id}' # この板を開いているクライアントが入る Socket.IO の部屋
+        self.posts = PostStore(settings['max_posts'], (Post.from_dict(p) for p in state['posts']))
+        self.topic = settings['topic']
+        self.max_posts = settings['max_posts']
+        self.page_size = settings['page_size'] # 最初に表示する投稿数
+        self.prevent_blue_id_post = settings['prevent_blue_id_post']
+        self.restrict_blue_id_post = settings['restrict_blue_id_post']
+        self.stop_blue_id_until = settings['stop_blue_id_until'] # タイムスタンプ
+        self.ng_words = list(state['ng_words'])
+        self.ng_matcher = NgWordMatcher(self.ng_words, normalize=ng_normalize)
+
+        # 描画済み投稿のキャッシュ {post_id: post_data}
+        # 色・接尾辞・権限が変わったときは、その表示用IDの投稿だけを捨てる
+        self.rendered_posts = {}
+        self.rendered_ids_by_display_id = {} # {display_id: {post_id, ...}}
+        # 投稿本文の転置インデックス（/destroy と /search で使う）
+        self.post_index = PostIndex()
+        for post in self.posts.newest():
+            self.post_index.add(post.id, post.message)
+        # 板の描画結果。状態を変えるたびに版数を上げて捨てる
+        self.page_cache = VersionedCache()
+
+        self.broadcaster = None # この板の部屋宛ての BroadcastScheduler（読み込む側で設定する）
+        self.clients = 0 # このプロセスで部屋に入っているクライアント数
+        self.loaded_at = time.time_ns() // 1000000 # ミリ秒（ETag で読み込み直す前のページと区別する）
+        self.last_used = time.monotonic()
+
+    def invalidate_rendered_posts(self, display_id):
+        """表示用IDの見た目が変わったので、そのIDの描画済み投稿を捨てる"""
+        for post_id in self.rendered_ids_by_display_id.pop(display_id, ()):
+            self.rendered_posts.pop(post_id, None)
+
+    def forget_posts(self, removed_posts):
+        """削除・追い出しされた投稿をキャッシュとインデックスから取り除く"""
+        for post in removed_posts:
+            self.post_index.remove(post.id)
+            post_data = self.rendered_posts.pop(post.id, None)
+            if post_data is None:
+                continue
+            ids = self.rendered_ids_by_display_id.get(post_data['display_id'])
+            if ids is not None:
+                ids.discard(post.id)
+                if not ids:
+                    del self.rendered_ids_by_display_id[post_data['display_id']]
+
+    def apply_post_added(self, post):
+        """投稿を追加し、上限を超えて追い出した投稿のリストを返す"""
+        post = Post.from_dict(post)
+        self.post_index.add(post.id, post.message)
+        # 投稿が最大数を超えた場合、古いものから削除される
+        evicted = self.posts.append(post)
+        self.forget_posts(evicted)
+        return evicted
+
+    def apply_posts_deleted(self, post_ids):
+        self.forget_posts(self.posts.delete(post_ids))
+
+    def apply_posts_cleared(self):
+        self.posts.clear()
+        self.rendered_posts.clear()
+        self.rendered_ids_by_display_id.clear()
+        self.post_index.clear()
+
+    def apply_settings(self, **values):
+        self.topic = values.get('topic', self.topic)
+        self.prevent_blue_id_post = values.get('prevent_blue_id_post', self.prevent_blue_id_post)
+        self.restrict_blue_id_post = values.get('restrict_blue_id_post', self.restrict_blue_id_post)
+        self.stop_blue_id_until = values.get('stop_blue_id_until', self.stop_blue_id_until)
+        self.page_size = values.get('page_size', self.page_size)
+        if 'max_posts' in values:
+            self.max_posts = values['max_posts']
+            self.forget_posts(self.posts.set_capacity(self.max_posts))
+
+    def apply_ng_word_added(self, word):
+        if word not in self.ng_words:
+            self.ng_words.append(word)
+            self.ng_matcher.add(word)
+
+    def apply_ng_word_removed(self, word):
+        if word in self.ng_words:
+            self.ng_words.remove(word)
+            self.ng_matcher.remove(word)
+
+
+class BoardRegistry:
+    """このプロセスが読み込んでいる板
+
+    板は最初に使われたときに load(board_id) で読み込む。クライアントが部屋にいないまま
+    idle_seconds 秒使われなかった板と、max_boards 個を超えた分（使われていない順）はメモリから外す。
+    外した板の状態はDBにあるので、次に使われたときに読み込み直す。
+    他のワーカーからの変更は apply で反映する。読み込み中の板への変更はためておき、登録するときに順に反映する
+    （DBを読んだ後の変更を取りこぼさないため。読んだ時点で含まれていた変更を重ねて反映しても結果は変わらない）。
+    """
+
+    def __init__(self, load, idle_seconds=600, max_boards=100, clock=time.monotonic):
+        self.load = load
+        self.idle_seconds = idle_seconds
+        self.max_boards = max_boards
+        self.clock = clock
+        self.boards = OrderedDict() # 使われた順（最後が最新）
+        self.loading = {} # {読み込み中の板ID: [読み込み後に反映する変更, ...]}
+        self.swept_at = clock()
+        self.lock = threading.Lock()
+
+    def get(self, board_id):
+        """板を返す（読み込んでいなければ読み込む）"""
+        now = self.clock()
+        with self.lock:
+            board = self.boards.get(board_id)
+            if board is not None:
+                self.boards.move_to_end(board_id)
+                board.last_used = now
+                if now - self.swept_at >= self.idle_seconds / 10:
+                    self._evict(now)
+                return board
+            self.loading.setdefault(board_id, [])
+        try:
+            board = self.load(board_id) # DBを読む間はロックを持たない
+        except BaseException:
+            with self.lock:
+                if board_id not in self.boards:
+                    self.loading.pop(board_id, None)
+            raise
+        with self.lock:
+            # 読み込んでいる間に他のスレッドが読み込んでいれば、そちらを使う
+            if board_id in self.boards:
+                board = self.boards[board_id]
+            else:
+                self.boards[board_id] = board
+                for change in self.loading.pop(board_id, ()):
+                    change(board)
+            self.boards.move_to_end(board_id)
+            board.last_used = now
+            self._evict(now)
+        return board
+
+    def apply(self, board_id, change):
+        """読み込み済みの板に change(board) を行う（読み込み中なら読み込み後に行い、読み込んでいなければ何もしない）"""
+        with self.lock:
+            board = self.boards.get(board_id)
+            if board is None:
+                if board_id in self.loading:
+                    self.loading[board_id].append(change)
+                return
+            # ロックを持ったまま反映し、読み込み時にためておいた変更より先に反映されないようにする
+            change(board)
+
+    def loaded(self, board_id):
+        """読み込み済みなら板を返す（読み込みはしない）"""
+        with self.lock:
+            return self.boards.get(board_id)
+
+    def values(self):
+        with self.lock:
+            return list(self.boards.values())
+
+    def __len__(self):
+        return len(self.boards)
+
+    def _evict(self, now):
+        self.swept_at = now
+        # 最後（いま使った板）は外さない
+        for board_id, board in list(self.boards.items())[:-1]:
+            if board.clients > 0:
+                continue
+            if len(self.boards) > self.max_boards or now - board.last_used >= self.idle_seconds:
+                del self.boards[board_id]
@@ -0,0 +1,97 @@
+import threading
+
+
+class BroadcastScheduler:
+    """全員宛てのイベントを interval 秒ためて、1つの batch イベントにまとめて送る
+
+    - 追加された投稿は順番どおりに送り、削除された投稿IDは1つのリストにまとめる
+    - /clear があれば、それより前の追加・削除は送らない
+    - 話題は最後に設定されたものだけを送る
+    - 全体の再描画が必要なら、ほかの変更は送らずスナップショットだけを送る（送る時点の状態で作るので変更も含まれる）
+    全員宛ての送信は interval 秒に1回までなので、投稿やコマンドが急に増えても送信の回数は増えない。
+    """
+
+    def __init__(self, socketio, emit, snapshot, interval):
+        self.socketio = socketio
+        self.emit = emit # (event, data, to=None) で送る関数
+        self.snapshot = snapshot # 送信時にスナップショットを作る関数
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.scheduled = False
+        self._reset()
+
+    def _reset(self):
+        self.cleared = False
+        self.posts = []
+        self.deleted_ids = {} # 順番を保って重複を除くため dict のキーにする
+        self.topic_changed = False
+        self.topic = None
+        self.refresh_all = False
+        self.refresh_sids = set()
+
+    def post_added(self, post_data):
+        with self.lock:
+            self.posts.append(post_data)
+            self._schedule()
+
+    def posts_deleted(self, post_ids):
+        # 同じ間隔内に追加された投稿も posts からは消さない（IDが連番のまま届くように、クライアントで追加してから消す）
+        with self.lock:
+            self.deleted_ids.update(dict.fromkeys(post_ids))
+            self._schedule()
+
+    def posts_cleared(self):
+        with self.lock:
+            self.cleared = True
+            self.posts = []
+            self.deleted_ids = {}
+            self._schedule()
+
+    def topic_updated(self, topic):
+        with self.lock:
+            self.topic_changed = True
+            self.topic = topic
+            self._schedule()
+
+    def refresh(self, sid=None):
+        """スナップショットの送信を予約する（sid が None なら全員宛て）"""
+        with self.lock:
+            if sid is None:
+                self.refresh_all = True
+            else:
+                self.refresh_sids.add(sid)
+            self._schedule()
+
+    def _schedule(self):
+        if not self.scheduled:
+            self.scheduled = True
+            self.socketio.start_background_task(self._flush_later)
+
+    def _flush_later(self):
+        self.socketio.sleep(self.interval)
+        self.flush()
+
+    def flush(self):
+        """たまっている変更を送る"""
+        with self.lock:
+            self.scheduled = False
+            cleared, posts, deleted_ids = self.cleared, self.posts, list(self.deleted_ids)
+            topic_changed, topic = self.topic_changed, self.topic
+            refresh_all, refresh_sids = self.refresh_all, self.refresh_sids
+            self._reset()
+
+        if refresh_all:
+            self.emit('batch', {'snapshot': self.snapshot()})
+            return # 個別のスナップショット要求もこれで満たされる
+
+        if cleared or posts or deleted_ids or topic_changed:
+            batch = {'cleared': cleared, 'posts': posts, 'deleted_ids': deleted_ids}
+            if topic_changed:
+                batch['topic'] = topic
+            self.emit('batch', batch)
+
+        # 全員宛ての変更を送った後に作るので、受け取ったクライアントはスナップショットで上書きするだけでよい
+        if refresh_sids:
+            snapshot = self.snapshot()
+            for sid in refresh_sids:
+                self.emit('update_posts', snapshot, to=sid)
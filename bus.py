@@ -0,0 +1,222 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from socketio import PubSubManager
+
+try:
+    import redis
+except ImportError: # redis:// のバスを使うときだけ必要
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# 受信に失敗したときに待つ秒数（失敗が続くたびに倍にし、MAX_RETRY_DELAY で止める。python-socketio の RedisManager と同じ）
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+
+
+def _deliver(subscribers, channel, payload):
+    """受信したメッセージを購読者に配る（壊れたメッセージや購読者の例外で、以降の配信を止めない）"""
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        logger.exception('バスのメッセージを読めませんでした（channel=%s）', channel)
+        return
+    for callback in subscribers.get(channel, []):
+        try:
+            callback(message)
+        except Exception:
+            logger.exception('バスのメッセージの処理に失敗しました（channel=%s）', channel)
+
+
+class LocalBus:
+    """同一プロセス内だけで配るバス（ワーカー1つで動かすとき用）"""
+
+    def __init__(self):
+        self.subscribers = {} # {channel: [callback, ...]}
+
+    def publish(self, channel, message):
+        for callback in self.subscribers.get(channel, []):
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        self.subscribers.setdefault(channel, []).append(callback)
+
+    def socketio_manager(self):
+        """1プロセスなら Socket.IO 標準のクライアント管理で足りる"""
+        return None
+
+
+class SqliteBus:
+    """SQLite ファイルを介して同じマシン上のプロセス間で配るバス
+
+    publish は行を追加するだけで、各プロセスのポーリングスレッドが新しい行を読んで配る。
+    ブローカーを用意できないローカル環境や、複数ワーカーの動作確認に使う。
+    """
+
+    def __init__(self, path, poll_interval=0.05, retention_seconds=60):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.poller = None
+
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS bus_messages ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'channel TEXT NOT NULL, '
+            'payload TEXT NOT NULL, '
+            'created_at REAL NOT NULL)'
+        )
+        # 起動前のメッセージは配らない
+        self.last_id = self.connection.execute('SELECT COALESCE(MAX(id), 0) FROM bus_messages').fetchone()[0]
+
+    def publish(self, channel, message):
+        with self.lock:
+            self.connection.execute(
+                'INSERT INTO bus_messages (channel, payload, created_at) VALUES (?, ?, ?)',
+                (channel, json.dumps(message), time.time()),
+            )
+
+    def subscribe(self, channel, callback):
+        with self.lock:
+            self.subscribers.setdefault(channel, []).append(callback)
+            if self.poller is None:
+                self.poller = threading.Thread(target=self._poll, daemon=True)
+                self.poller.start()
+
+    def socketio_manager(self):
+        return BusClientManager(self)
+
+    def _poll(self):
+        last_cleanup = time.time()
+        retry_delay = RETRY_DELAY
+        while True:
+            try:
+                with self.lock:
+                    rows = self.connection.execute(
+                        'SELECT id, channel, payload FROM bus_messages WHERE id > ? ORDER BY id',
+                        (self.last_id,),
+                    ).fetchall()
+                    if time.time() - last_cleanup > self.retention_seconds:
+                        self.connection.execute(
+                            'DELETE FROM bus_messages WHERE created_at < ?',
+                            (time.time() - self.retention_seconds,),
+                        )
+                        last_cleanup = time.time()
+            except sqlite3.Error:
+                # database is locked など。last_id は進めていないので、読み直せば取りこぼさない
+                logger.exception('バスを読めませんでした。%d秒後に読み直します', retry_delay)
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+                continue
+            retry_delay = RETRY_DELAY
+            for message_id, channel, payload in rows:
+                self.last_id = message_id
+                _deliver(self.subscribers, channel, payload)
+            if not rows:
+                time.sleep(self.poll_interval)
+
+
+class RedisBus:
+    """Redis の Pub/Sub で配るバス（複数のマシン・インスタンスで共有するとき用）
+
+    受信は購読用の接続を読むスレッドが行う。購読する前（起動前）のメッセージは届かない。
+    """
+
+    def __init__(self, url, poll_interval=0.05):
+        if redis is None:
+            raise RuntimeError('redis:// のバスを使うには redis パッケージが必要です（pip install redis）')
+        self.client = redis.Redis.from_url(url)
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.poll_interval = poll_interval
+        self.subscribers = {}
+        self.lock = threading.Lock() # 購読用の接続は受信スレッドと subscribe で共有する
+        self.listener = None
+
+    def publish(self, channel, message):
+        self.client.publish(channel, json.dumps(message))
+
+    def subscribe(self, channel, callback):
+        with self.lock:
+            if channel not in self.subscribers:
+                self.pubsub.subscribe(channel)
+            self.subscribers.setdefault(channel, []).append(callback)
+            if self.listener is None:
+                self.listener = threading.Thread(target=self._listen, daemon=True)
+                self.listener.start()
+
+    def socketio_manager(self):
+        return BusClientManager(self)
+
+    def _listen(self):
+        retry_delay = RETRY_DELAY
+        reconnect = False
+        while True:
+            try:
+                # 待つ間もロックを持つので、短い間隔で区切って subscribe を待たせすぎないようにする
+                with self.lock:
+                    if reconnect:
+                        self._resubscribe()
+                        reconnect = False
+                    item = self.pubsub.get_message(timeout=self.poll_interval)
+            except redis.RedisError:
+                # 切断中に出されたメッセージは届かない（Pub/Sub は保存しない）
+                logger.exception('Redis から受信できませんでした。%d秒後に接続し直します', retry_delay)
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+                reconnect = True
+                continue
+            retry_delay = RETRY_DELAY
+            if item is None or item['type'] != 'message':
+                continue
+            _deliver(self.subscribers, item['channel'].decode(), item['data'])
+
+    def _resubscribe(self):
+        """購読用の接続を作り直し、購読していたチャンネルを購読し直す（self.lock を持って呼ぶ）"""
+        try:
+            self.pubsub.close()
+        except redis.RedisError:
+            pass
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(*self.subscribers)
+
+
+class BusClientManager(PubSubManager):
+    """Socket.IO の emit をバス経由で全プロセスに配るクライアント管理"""
+    name = 'board-bus'
+
+    def __init__(self, board_bus, channel='socketio'):
+        super().__init__(channel=channel)
+        self.board_bus = board_bus
+        self.messages = queue.Queue()
+        board_bus.subscribe(channel, self.messages.put)
+
+    def _publish(self, data):
+        self.board_bus.publish(self.channel, data)
+
+    def _listen(self):
+        while True:
+            yield self.messages.get()
+
+
+def create_bus(url):
+    """BOARD_BUS_URL からバスを作る
+
+    - 未指定 / local:// : プロセス内のみ
+    - sqlite:///path/to/bus.db : 同じマシン上の複数プロセスで共有
+    - redis:// / rediss:// : 複数のマシン・インスタンスで共有
+    """
+    if not url or url.startswith('local://'):
+        return LocalBus()
+    if url.startswith('sqlite:///'):
+        return SqliteBus(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisBus(url)
+    raise ValueError(f'未対応のバスURLです: {url}')
@@ -0,0 +1,123 @@
+import json
+import re
+from collections import namedtuple
+
+# 権限の強さ。コマンドの必要権限は登録時にこの数値にしておき、実行時は比較するだけにする
+ROLE_LEVELS = {'normal': 0, 'speaker': 1, 'manager': 2, 'moderator': 3, 'summit': 4, 'operator': 5}
+
+# roles.json のキーと権限（下位から順に読み、複数のリストにあるIDは上位の権限にする）
+ROLE_SEED_KEYS = (
+    ('speaker', 'SPEAKER_HASHES'),
+    ('manager', 'MANAGER_HASHES'),
+    ('moderator', 'MODERATOR_HASHES'),
+    ('summit', 'SUMMIT_HASHES'),
+)
+
+# 表示用ID（名前とシードのSHA256の先頭7文字を大文字にしたもの）
+DISPLAY_ID_PATTERN = re.compile(r'^[0-9A-F]{7}$')
+
+PERMISSION_DENIED = 'このコマンドを実行する権限がありません。'
+
+# コマンドを実行したユーザーと、コマンドを書き込んだ板
+Caller = namedtuple('Caller', ['display_id', 'role', 'board'])
+
+# 登録済みのコマンド（min_level: 必要な権限の数値、parse: 引数の解析関数、handler: 処理関数）
+Command = namedtuple('Command', ['min_level', 'parse', 'handler'])
+
+
+def load_seed_roles(path):
+    """roles.json から {display_id: role} を作る
+
+    各リストには表示用ID（7文字）か、名前とシードのSHA256全体（先頭7文字が表示用ID）を書く。
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    seeded = {}
+    for role, key in ROLE_SEED_KEYS:
+        for value in data.get(key, []):
+            display_id = str(value).strip()[:7].upper()
+            if display_id:
+                seeded[display_id] = role
+    return seeded
+
+
+class CommandRegistry:
+    """スラッシュコマンドの表
+
+    コマンドごとに必要な権限と引数の解析関数を登録しておき、実行時は辞書を1回引くだけで処理関数を決める。
+    処理関数は (caller, 解析済みの引数) を受け取り、(category, message) を返す。
+    """
+
+    def __init__(self):
+        self.commands = {}
+
+    def register(self, name, min_role='normal', parse=None):
+        """コマンドを登録するデコレーター（parse が None なら引数の文字列をそのまま渡す）"""
+        def decorator(handler):
+            self.commands[name] = Command(ROLE_LEVELS[min_role], parse, handler)
+            return handler
+        return decorator
+
+    def dispatch(self, message, caller):
+        """コマンドを実行し、ユーザーに表示する (category, message) を返す"""
+        name, _, arg = message.partition(' ')
+        command = self.commands.get(name)
+        if command is None:
+            return 'error', f'不明なコマンド: {name}'
+        if ROLE_LEVELS.get(caller.role, 0) < command.min_level:
+            return 'error', PERMISSION_DENIED
+        if command.parse is not None:
+            try:
+                arg = command.parse(arg)
+            except ValueError as e:
+                return 'error', str(e)
+        return command.handler(caller, arg)
+
+
+# 引数の解析関数。不正な引数は ValueError（ユーザーに表示する文言）にする
+
+def stripped(arg):
+    return arg.strip()
+
+
+def required(usage, strip=False):
+    """空でない文字列を求める"""
+    def parse(arg):
+        if strip:
+            arg = arg.strip()
+        if not arg:
+            raise ValueError(usage)
+        return arg
+    return parse
+
+
+def integer(usage):
+    def parse(arg):
+        try:
+            return int(arg)
+        except ValueError:
+            raise ValueError(usage) from None
+    return parse
+
+
+def id_list(usage):
+    """カンマ区切りの投稿ID（重複は除き、順番は保つ）"""
+    def parse(arg):
+        try:
+            return list(dict.fromkeys(int(i.strip()) for i in arg.split(',')))
+        except ValueError:
+            raise ValueError(usage) from None
+    return parse
+
+
+def user_id(usage):
+    """表示用ID（16進数7文字。小文字で書いてもよい）"""
+    def parse(arg):
+        arg = arg.strip().upper()
+        if not DISPLAY_ID_PATTERN.match(arg):
+            raise ValueError(usage)
+        return arg
+    return parse
@@ -0,0 +1,43 @@
+import os
+
+# Socket.IO の非同期モードに合わせてワーカーの種類を選ぶ
+# gevent（既定） / eventlet ではグリーンスレッドで大量の WebSocket 接続を1ワーカーで保持できる
+# threading は同期ワーカーと同じく接続ごとにスレッドを使うので、開発・動作確認用
+async_mode = os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'gevent')
+
+WORKER_CLASSES = {
+    'gevent': 'gevent',
+    'eventlet': 'eventlet',
+    'threading': 'gthread',
+}
+worker_class = WORKER_CLASSES[async_mode]
+
+# 2ワーカー以上にする場合は、状態の変更を共有するバスを BOARD_BUS_URL（sqlite:/// か redis://）に設定すること
+# SOCKETIO_MESSAGE_QUEUE（redis://）だけを設定した場合は、それが状態の共有にも使われる
+# 複数のインスタンス（マシン）で動かす場合は redis:// が必要（sqlite:/// は同じマシン上のプロセス間でしか共有できない）
+# （ロングポーリングを使うクライアントがいる場合はロードバランサー側でスティッキーセッションも必要）
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+bus_url = os.environ.get('BOARD_BUS_URL') or os.environ.get('SOCKETIO_MESSAGE_QUEUE') or 'local://'
+if workers > 1 and bus_url.startswith('local://'):
+    # ワーカーごとにメモリ上の板の状態がずれていくので、起動させない
+    raise RuntimeError('WEB_CONCURRENCY が2以上のときは BOARD_BUS_URL か SOCKETIO_MESSAGE_QUEUE を設定してください')
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', '10000'))
+threads = int(os.environ.get('GUNICORN_THREADS', '50')) # gthread のときのみ使われる
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+
+
+def post_fork(server, worker):
+    """PostgreSQL のドライバー（psycopg2）の待ちをグリーンスレッドの切り替えにする
+
+    psycopg2 は C 実装でソケットを直接待つので、そのままでは gevent / eventlet のワーカーで
+    DATABASE_URL が postgresql:// のとき、クエリのたびにワーカー全体（その上の全 WebSocket 接続）が止まる。
+    """
+    if not os.environ.get('DATABASE_URL', '').startswith('postgres'):
+        return
+    if async_mode == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+    elif async_mode == 'eventlet':
+        from psycogreen.eventlet import patch_psycopg
+    else:
+        return
+    patch_psycopg()
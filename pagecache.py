@@ -0,0 +1,57 @@
+import gzip
+import threading
+import time
+
+try:
+    import brotli
+except ImportError: # brotli は任意。入っていなければ gzip だけを使う
+    brotli = None
+
+
+def choose_encoding(accept_encodings):
+    """クライアントが受け取れる圧縮方式（br > gzip > なし）"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return 'identity'
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+class VersionedCache:
+    """板の版数が変わるまで描画結果を使い回すキャッシュ
+
+    状態を変えるたびに bump() で版数を上げ、それまでの結果を捨てる。
+    作っている間に版数が上がった結果は保存しない（古い状態を新しい版のものとして返さないため）。
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.updated_at = time.time() # Last-Modified に使う
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def bump(self):
+        with self.lock:
+            self.version += 1
+            self.updated_at = time.time()
+            self.entries = {}
+
+    def get(self, key, build):
+        """この版の key の結果を返す（まだなければ build() で作る）"""
+        with self.lock:
+            version = self.version
+            if key in self.entries:
+                return self.entries[key]
+        value = build()
+        with self.lock:
+            if self.version == version:
+                self.entries[key] = value
+        return value
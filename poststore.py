@@ -0,0 +1,146 @@
+import threading
+from bisect import bisect_left
+
+# 先頭側の空き・削除済みIDがこの数を超えたら詰め直す
+COMPACT_THRESHOLD = 1024
+
+
+class Post:
+    """掲示板の1投稿（大量に持つので __slots__ で小さくする）"""
+    __slots__ = ('id', 'name', 'message', 'display_id')
+
+    def __init__(self, id, name, message, display_id):
+        self.id = id
+        self.name = name
+        self.message = message
+        self.display_id = display_id
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['id'], data['name'], data['message'], data['display_id'])
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'message': self.message,
+            'display_id': self.display_id,
+        }
+
+
+class PostStore:
+    """上限付きの投稿置き場
+
+    投稿IDの昇順リスト（先頭位置をずらしていくリングバッファ）と {id: Post} の辞書を持つ。
+    - 追加・古い投稿の追い出し: O(1)（ならし）
+    - ID指定の削除: 削除するk件に対して O(k)。リストには削除済みの印だけ残し、溜まったら詰め直す
+    - 新しい順の取得: 必要な件数だけ辿る。before 指定時は二分探索で開始位置を決める
+    """
+
+    def __init__(self, capacity, posts=()):
+        self.capacity = capacity
+        self.ids = [] # 昇順。self.posts にないIDは削除済み
+        self.start = 0 # self.ids のうち、これより前は追い出し済み
+        self.posts = {}
+        self.deleted_count = 0 # self.ids[self.start:] に残っている削除済みIDの数
+        self.lock = threading.Lock()
+        for post in posts:
+            self.append(post)
+
+    def __len__(self):
+        return len(self.posts)
+
+    def __contains__(self, post_id):
+        return post_id in self.posts
+
+    def get(self, post_id):
+        return self.posts.get(post_id)
+
+    def latest_id(self):
+        """最新の投稿ID（投稿がなければ None）"""
+        with self.lock:
+            for index in range(len(self.ids) - 1, self.start - 1, -1):
+                if self.ids[index] in self.posts:
+                    return self.ids[index]
+        return None
+
+    def append(self, post):
+        """投稿を追加し、上限を超えて追い出した投稿のリストを返す"""
+        with self.lock:
+            if post.id in self.posts:
+                return []
+            if self.ids and post.id <= self.ids[-1]:
+                # 他のワーカーの投稿が前後して届いた場合。削除済みの印が残っていれば、それを使う
+                index = bisect_left(self.ids, post.id, lo=self.start)
+                if index < len(self.ids) and self.ids[index] == post.id:
+                    self.deleted_count -= 1
+                else:
+                    self.ids.insert(index, post.id)
+            else:
+                self.ids.append(post.id)
+            self.posts[post.id] = post
+            return self._evict_over_capacity()
+
+    def delete(self, post_ids):
+        """指定IDの投稿を削除し、実際に削除した投稿のリストを返す"""
+        deleted = []
+        with self.lock:
+            for post_id in post_ids:
+                post = self.posts.pop(post_id, None)
+                if post is not None:
+                    deleted.append(post)
+            self.deleted_count += len(deleted)
+            if self.deleted_count > len(self.posts) + COMPACT_THRESHOLD:
+                self._compact()
+        return deleted
+
+    def clear(self):
+        with self.lock:
+            self.ids = []
+            self.start = 0
+            self.posts = {}
+            self.deleted_count = 0
+
+    def set_capacity(self, capacity):
+        """上限を変更し、追い出した投稿のリストを返す"""
+        with self.lock:
+            self.capacity = capacity
+            return self._evict_over_capacity()
+
+    def newest(self, limit=None, before=None, after=None):
+        """新しい順に投稿を返す（before より前、after より後のIDに絞れる）"""
+        result = []
+        with self.lock:
+            index = len(self.ids) - 1
+            if before is not None:
+                index = bisect_left(self.ids, before, lo=self.start) - 1
+            while index >= self.start:
+                post_id = self.ids[index]
+                if after is not None and post_id <= after:
+                    break
+                post = self.posts.get(post_id)
+                if post is not None:
+                    result.append(post)
+                    if limit is not None and len(result) >= limit:
+                        break
+                index -= 1
+        return result
+
+    def _evict_over_capacity(self):
+        evicted = []
+        while len(self.posts) > self.capacity:
+            post_id = self.ids[self.start]
+            self.start += 1
+            post = self.posts.pop(post_id, None)
+            if post is None:
+                self.deleted_count -= 1
+            else:
+                evicted.append(post)
+        if self.start > COMPACT_THRESHOLD and self.start > len(self.ids) // 2:
+            self._compact()
+        return evicted
+
+    def _compact(self):
+        self.ids = [post_id for post_id in self.ids[self.start:] if post_id in self.posts]
+        self.start = 0
+        self.deleted_count = 0
@@ -0,0 +1,73 @@
+import _thread
+import os
+import sys
+import time
+
+try:
+    from gevent import monkey
+except ImportError:
+    monkey = None
+
+
+def _original(module, name, default):
+    """gevent の monkey patch 前の関数（採取はグリーンレットではなく本物のスレッドで行う）"""
+    if monkey is None:
+        return default
+    return monkey.get_original(module, name)
+
+
+_start_new_thread = _original('_thread', 'start_new_thread', _thread.start_new_thread)
+_get_ident = _original('_thread', 'get_ident', _thread.get_ident)
+_sleep = _original('time', 'sleep', time.sleep)
+
+
+class SamplingProfiler:
+    """一定間隔で全スレッドのスタックを採取する簡易プロファイラー
+
+    動かしている間だけ別スレッドで採取するので、止めている間の負荷はない。
+    結果は flamegraph.pl や speedscope で読める collapsed 形式（"関数;関数;... 回数"）で返す。
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.running = False
+        self.samples = {} # {スタック: 採取回数}
+        self.sample_count = 0
+
+    def start(self, seconds):
+        """seconds 秒間の採取を始める（実行中なら False）"""
+        if self.running:
+            return False
+        self.running = True
+        self.samples = {}
+        self.sample_count = 0
+        _start_new_thread(self._run, (seconds,))
+        return True
+
+    def stop(self):
+        self.running = False
+
+    def _run(self, seconds):
+        own_id = _get_ident()
+        deadline = time.monotonic() + seconds
+        try:
+            while self.running and time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                        frame = frame.f_back
+                    key = ';'.join(reversed(stack))
+                    self.samples[key] = self.samples.get(key, 0) + 1
+                self.sample_count += 1
+                _sleep(self.interval)
+        finally:
+            self.running = False
+
+    def report(self):
+        """採取したスタックを多い順に collapsed 形式で返す"""
+        samples = dict(self.samples)
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(samples.items(), key=lambda item: -item[1]))
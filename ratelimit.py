@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """キー（表示用IDやIP）ごとのトークンバケット
+
+    バケットは最後に使った順に並べ、max_keys を超えたら最も長く使われていないものから捨てる。
+    捨てられるのはしばらく投稿していない相手のバケット（満タンに戻っているはず）なので、判定はほぼ変わらない。
+    """
+
+    def __init__(self, max_keys=10000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self.buckets = OrderedDict() # {key: (残りトークン, 最後に計算した時刻)}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def acquire(self, key, rate, burst):
+        """トークンを1つ使う。使えれば 0、使えなければ次のトークンまでの秒数を返す
+
+        rate は1秒あたりに補充するトークン数、burst はバケットの容量（連続で投稿できる数）。
+        """
+        now = self.clock()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                tokens = burst
+            else:
+                tokens, updated_at = bucket
+                tokens = min(burst, tokens + (now - updated_at) * rate)
+                self.buckets.move_to_end(key)
+            if tokens >= 1:
+                wait = 0
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
@@ -0,0 +1,60 @@
+import threading
+
+
+def bigrams(text):
+    """文字単位の2-gram（日本語は単語の区切りがないので文字で切る）"""
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class PostIndex:
+    """投稿本文の2-gram転置インデックス
+
+    部分文字列の検索では、クエリの2-gramをすべて含む投稿だけを候補にし、
+    最後に実際の本文で確認する。1文字のクエリは全投稿が候補になる。
+    """
+
+    def __init__(self):
+        self.postings = {} # {2-gram: {post_id, ...}}
+        self.messages = {} # {post_id: message}
+        self.lock = threading.Lock()
+
+    def add(self, post_id, message):
+        with self.lock:
+            self.messages[post_id] = message
+            for gram in bigrams(message):
+                self.postings.setdefault(gram, set()).add(post_id)
+
+    def remove(self, post_id):
+        with self.lock:
+            message = self.messages.pop(post_id, None)
+            if message is None:
+                return
+            for gram in bigrams(message):
+                ids = self.postings.get(gram)
+                if ids is not None:
+                    ids.discard(post_id)
+                    if not ids:
+                        del self.postings[gram]
+
+    def clear(self):
+        with self.lock:
+            self.postings.clear()
+            self.messages.clear()
+
+    def search(self, query):
+        """query を本文に含む投稿IDの集合"""
+        if not query:
+            return set()
+        with self.lock:
+            grams = bigrams(query)
+            if not grams:
+                candidates = set(self.messages)
+            else:
+                # 件数の少ない2-gramから絞り込む
+                posting_lists = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+                candidates = set(posting_lists[0])
+                for ids in posting_lists[1:]:
+                    candidates &= ids
+                    if not candidates:
+                        break
+            return {post_id for post_id in candidates if query in self.messages[post_id]}
@@ -0,0 +1,312 @@
+import os
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import delete, event, inspect, select, text, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+db = SQLAlchemy()
+
+# 板IDを指定しない URL（トップページなど）はこの板を表示する
+BOARD_ID = 'main'
+# 初回起動時に作る板 {板ID: 表示名}（ほかの板は /board で作る）
+DEFAULT_BOARDS = {
+    BOARD_ID: '雑談',
+    'battle': 'バトルスタジアム',
+}
+
+DEFAULT_TOPIC = "岡山アンチの投稿を永遠に規制中"
+DEFAULT_MAX_POSTS = 100
+DEFAULT_PAGE_SIZE = 50
+
+
+class Board(db.Model):
+    """掲示板ごとの設定と規制状態"""
+    __tablename__ = 'boards'
+
+    id = db.Column(db.String(64), primary_key=True)
+    name = db.Column(db.String(50), nullable=False, default='', server_default='') # 板の一覧に出す表示名
+    topic = db.Column(db.String(200), nullable=False, default=DEFAULT_TOPIC)
+    next_post_id = db.Column(db.Integer, nullable=False, default=1)
+    max_posts = db.Column(db.Integer, nullable=False, default=DEFAULT_MAX_POSTS)
+    page_size = db.Column(db.Integer, nullable=False, default=DEFAULT_PAGE_SIZE, server_default=str(DEFAULT_PAGE_SIZE))
+    prevent_blue_id_post = db.Column(db.Boolean, nullable=False, default=False)
+    restrict_blue_id_post = db.Column(db.Boolean, nullable=False, default=False)
+    stop_blue_id_until = db.Column(db.Float, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'topic': self.topic,
+            'max_posts': self.max_posts,
+            'page_size': self.page_size,
+            'prevent_blue_id_post': self.prevent_blue_id_post,
+            'restrict_blue_id_post': self.restrict_blue_id_post,
+            'stop_blue_id_until': self.stop_blue_id_until,
+        }
+
+
+class Post(db.Model):
+    """投稿（表示用IDは投稿時に計算して保存する）"""
+    __tablename__ = 'posts'
+
+    board_id = db.Column(db.String(64), primary_key=True, server_default=BOARD_ID)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False) # 板ごとの投稿番号
+    display_id = db.Column(db.String(7), nullable=False, index=True)
+    name = db.Column(db.String(25), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    ip = db.Column(db.String(45), nullable=False, server_default='') # /ban 投稿番号 用。表示には使わない
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'message': self.message,
+            'display_id': self.display_id,
+        }
+
+
+class NgWord(db.Model):
+    __tablename__ = 'ng_words'
+
+    board_id = db.Column(db.String(64), primary_key=True, server_default=BOARD_ID)
+    word = db.Column(db.String(100), primary_key=True)
+
+
+class UserColor(db.Model):
+    __tablename__ = 'user_colors'
+
+    display_id = db.Column(db.String(7), primary_key=True)
+    color = db.Column(db.String(20), nullable=False)
+
+
+class UserSuffix(db.Model):
+    __tablename__ = 'user_suffixes'
+
+    display_id = db.Column(db.String(7), primary_key=True)
+    text = db.Column(db.String(100), nullable=False)
+    color = db.Column(db.String(20), nullable=False, default='magenta')
+
+
+class UserRole(db.Model):
+    __tablename__ = 'user_roles'
+
+    display_id = db.Column(db.String(7), primary_key=True)
+    role = db.Column(db.String(20), nullable=False)
+
+
+class Block(db.Model):
+    """/kill（表示用ID）・/ban（IP）で投稿を禁止した相手"""
+    __tablename__ = 'blocks'
+
+    kind = db.Column(db.String(10), primary_key=True) # 'display_id' または 'ip'
+    value = db.Column(db.String(45), primary_key=True)
+
+
+def _enable_sqlite_wal(dbapi_connection, connection_record):
+    """SQLite では WAL を有効にし、読み込みと書き込みが互いを待たないようにする"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+def _add_missing_columns():
+    """既存のテーブルに後から追加した列を足す（server_default を持つ列のみ）"""
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or column.server_default is None:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                default = column.server_default.arg
+                connection.execute(text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type} NOT NULL DEFAULT '{default}'"
+                ))
+
+
+def _rebuild_changed_primary_keys():
+    """主キーが変わったテーブル（板IDを主キーに足した posts・ng_words）を作り直し、行を移す
+
+    ALTER TABLE では主キーを変えられないので、行を退避してから新しい定義で作り直す。
+    列は _add_missing_columns で足してあるので、退避した行をそのまま入れ直せる。
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = inspector.get_pk_constraint(table.name)['constrained_columns']
+        if set(existing) == {column.name for column in table.primary_key.columns}:
+            continue
+        columns = ', '.join(column['name'] for column in inspector.get_columns(table.name))
+        backup = f'{table.name}_backup'
+        with db.engine.begin() as connection:
+            connection.execute(text(f'CREATE TABLE {backup} AS SELECT * FROM {table.name}'))
+            table.drop(connection)
+            table.create(connection)
+            connection.execute(text(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {backup}'))
+            connection.execute(text(f'DROP TABLE {backup}'))
+
+
+def init_app(app):
+    """DBの接続設定を行い、テーブルと初期データを用意する"""
+    database_url = os.environ.get('DATABASE_URL', 'sqlite:///bbs.db')
+    # Render などが渡す postgres:// は SQLAlchemy では postgresql:// と書く必要がある
+    if database_url.startswith('postgres://'):
+        database_url = database_url.replace('postgres://', 'postgresql://', 1)
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', database_url)
+    db.init_app(app)
+
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', _enable_sqlite_wal)
+        # 複数ワーカーが同時に起動すると、テーブル作成や初期行の追加が競合することがある
+        for attempt in range(3):
+            try:
+                db.create_all()
+                _add_missing_columns()
+                _rebuild_changed_primary_keys()
+                break
+            except OperationalError:
+                if attempt == 2:
+                    raise
+        for board_id, name in DEFAULT_BOARDS.items():
+            board = db.session.get(Board, board_id)
+            if board is None:
+                db.session.add(Board(id=board_id, name=name))
+            elif not board.name:
+                board.name = name # 表示名の列を足す前からある板
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback() # 他のワーカーが先に作成した
+
+
+def load_board(board_id):
+    """板を読み込むときにメモリへ載せる状態をまとめて読み込む"""
+    board = db.session.get(Board, board_id)
+    recent = db.session.execute(
+        select(Post).where(Post.board_id == board_id).order_by(Post.id.desc()).limit(board.max_posts)
+    ).scalars().all()
+    return {
+        'board': board.to_dict(),
+        'posts': [post.to_dict() for post in reversed(recent)],
+        'ng_words': db.session.execute(select(NgWord.word).where(NgWord.board_id == board_id)).scalars().all(),
+    }
+
+
+def load_state():
+    """起動時にメモリへ載せる、板によらない状態（ユーザーごとの設定）をまとめて読み込む"""
+    return {
+        'user_colors': {row.display_id: row.color for row in UserColor.query.all()},
+        'user_suffixes': {row.display_id: {'text': row.text, 'color': row.color} for row in UserSuffix.query.all()},
+        'user_roles': {row.display_id: row.role for row in UserRole.query.all()},
+        'blocks': [{'kind': row.kind, 'value': row.value} for row in Block.query.all()],
+        'boards': {row.id: row.name or row.id for row in Board.query.order_by(Board.id != BOARD_ID, Board.id).all()},
+    }
+
+
+def ping():
+    """DBに問い合わせられるか確認する（/health 用）"""
+    db.session.execute(text('SELECT 1'))
+
+
+def create_board(board_id, name):
+    """板を作る（既にあれば False）"""
+    db.session.add(Board(id=board_id, name=name))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
+
+def add_post(board_id, name, message, display_id, ip=''):
+    """投稿番号を採番して投稿を保存する
+
+    採番はボード行の UPDATE で行うので、複数ワーカーから同時に投稿されても番号は重複しない。
+    """
+    db.session.execute(
+        update(Board).where(Board.id == board_id).values(next_post_id=Board.next_post_id + 1)
+    )
+    post_id = db.session.execute(
+        select(Board.next_post_id).where(Board.id == board_id)
+    ).scalar_one() - 1
+    post = Post(board_id=board_id, id=post_id, name=name, message=message, display_id=display_id, ip=ip)
+    db.session.add(post)
+    db.session.commit()
+    return post.to_dict()
+
+
+def get_post_ip(board_id, post_id):
+    """投稿者のIP（投稿がない・記録がなければ None）"""
+    return db.session.execute(
+        select(Post.ip).where(Post.board_id == board_id, Post.id == post_id)
+    ).scalar() or None
+
+
+def trim_posts(board_id, max_posts):
+    """新しい方から max_posts 件を残し、それより古い投稿を一括削除する（/max で上限を変えたとき）"""
+    cutoff = db.session.execute(
+        select(Post.id).where(Post.board_id == board_id).order_by(Post.id.desc()).offset(max_posts).limit(1)
+    ).scalar()
+    if cutoff is not None:
+        db.session.execute(delete(Post).where(Post.board_id == board_id, Post.id <= cutoff))
+        db.session.commit()
+
+
+def delete_posts(board_id, post_ids):
+    if post_ids:
+        db.session.execute(delete(Post).where(Post.board_id == board_id, Post.id.in_(post_ids)))
+        db.session.commit()
+
+
+def clear_posts(board_id):
+    """板の全投稿を削除し、投稿番号を1に戻す"""
+    db.session.execute(delete(Post).where(Post.board_id == board_id))
+    db.session.execute(update(Board).where(Board.id == board_id).values(next_post_id=1))
+    db.session.commit()
+
+
+def update_board(board_id, **values):
+    db.session.execute(update(Board).where(Board.id == board_id).values(**values))
+    db.session.commit()
+
+
+def add_ng_word(board_id, word):
+    db.session.merge(NgWord(board_id=board_id, word=word))
+    db.session.commit()
+
+
+def remove_ng_word(board_id, word):
+    db.session.execute(delete(NgWord).where(NgWord.board_id == board_id, NgWord.word == word))
+    db.session.commit()
+
+
+def set_user_color(display_id, color):
+    db.session.merge(UserColor(display_id=display_id, color=color))
+    db.session.commit()
+
+
+def set_user_suffix(display_id, text, color):
+    db.session.merge(UserSuffix(display_id=display_id, text=text, color=color))
+    db.session.commit()
+
+
+def set_user_role(display_id, role):
+    """権限を保存する（'normal' も行として残し、roles.json の初期値より優先させる）"""
+    db.session.merge(UserRole(display_id=display_id, role=role))
+    db.session.commit()
+
+
+def add_block(kind, value):
+    db.session.merge(Block(kind=kind, value=value))
+    db.session.commit()
+
+
+def remove_blocks(value):
+    """value に一致するブロックを種類を問わず解除する"""
+    db.session.execute(delete(Block).where(Block.value == value))
+    db.session.commit()
@@ -0,0 +1,51 @@
+"""test_sqlite_bus.py が別プロセスとして起動するワーカー
+
+標準入力から1行に1件のJSONで操作を受け取り、結果をJSONで1行ずつ標準出力に返す。
+DATABASE_URL と BOARD_BUS_URL は呼び出し側が環境変数で渡す。
+"""
+import json
+import sys
+
+# app の import 中の出力で結果の行が崩れないよう、結果以外は標準エラーに出す
+out = sys.stdout
+sys.stdout = sys.stderr
+
+import app # noqa: E402
+
+
+def submit(board, name, message, seed, ip):
+    with app.app.test_request_context():
+        return app.submit_message(app.boards.get(board), name, message, seed, ip)
+
+
+def display_id(name, seed):
+    return app.get_display_id(name, seed)
+
+
+def grant(display_id, role):
+    return app.set_user_role(display_id, role)
+
+
+def state(board):
+    """この板とユーザーの、このプロセスのメモリ上の状態"""
+    return {
+        'posts': [post.to_dict() for post in app.boards.get(board).posts.newest()],
+        'user_roles': app.user_roles,
+        'blocklists': {kind: sorted(values) for kind, values in app.blocklists.items()},
+    }
+
+
+OPERATIONS = {'submit': submit, 'display_id': display_id, 'grant': grant, 'state': state}
+
+
+def main():
+    app.app.app_context().push()
+    print(json.dumps({'ready': True}), file=out, flush=True)
+    for line in sys.stdin:
+        request = json.loads(line)
+        result = OPERATIONS[request.pop('op')](**request)
+        print(json.dumps(result), file=out, flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+# リポジトリ直下のモジュール（app.py, poststore.py など）を import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app は import 時にDBとバスを開くので、テスト用の一時DBと1プロセス用のバスにしておく
+_tmp_dir = tempfile.mkdtemp(prefix='bbs-test-')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_tmp_dir, "bbs.db")}'
+os.environ['BOARD_BUS_URL'] = 'local://'
+os.environ['SOCKETIO_ASYNC_MODE'] = 'threading'
+os.environ.pop('SOCKETIO_MESSAGE_QUEUE', None)
+os.environ.pop('MONITORING_TOKEN', None)
+
+
+@pytest.fixture
+def bbs():
+    """app モジュール（アプリケーションコンテキストの中で使う）"""
+    import app
+    with app.app.app_context():
+        yield app
+
+
+@pytest.fixture
+def board(bbs):
+    """テストごとに新しく作った板"""
+    board_id = f'test{next(_board_numbers)}'
+    bbs.storage.create_board(board_id, board_id)
+    bbs.apply_change('board_created', board_id=board_id, name=board_id)
+    return bbs.boards.get(board_id)
+
+
+@pytest.fixture
+def add_posts(bbs):
+    """板に count 件投稿する（DBに保存してメモリに反映する）"""
+    def add(board, count, display_id='A000000'):
+        for i in range(count):
+            post = bbs.storage.add_post(board.id, '名無し', f'投稿{i}', display_id)
+            bbs.apply_change('post_added', board, post=post)
+    return add
+
+
+_board_numbers = itertools.count()
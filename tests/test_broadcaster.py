@@ -0,0 +1,100 @@
+"""BroadcastScheduler（一定間隔ごとに変更をまとめて送る）"""
+import pytest
+
+from broadcaster import BroadcastScheduler
+
+
+class FakeSocketIO:
+    """バックグラウンドタスクを起動せず、数えるだけ（送信はテストから flush を呼んで行う）"""
+
+    def __init__(self):
+        self.tasks = 0
+
+    def start_background_task(self, target):
+        self.tasks += 1
+
+
+@pytest.fixture
+def sent():
+    return []
+
+
+@pytest.fixture
+def socketio():
+    return FakeSocketIO()
+
+
+@pytest.fixture
+def scheduler(socketio, sent):
+    snapshots = iter(range(1, 100))
+    return BroadcastScheduler(
+        socketio,
+        lambda event, data, to=None: sent.append((event, data, to)),
+        lambda: {'snapshot_number': next(snapshots)},
+        interval=0.05,
+    )
+
+
+def test_schedules_one_flush_per_interval(scheduler, socketio, sent):
+    scheduler.post_added({'id': 1})
+    scheduler.post_added({'id': 2})
+    scheduler.posts_deleted([1])
+    assert socketio.tasks == 1
+    scheduler.flush()
+    scheduler.post_added({'id': 3})
+    assert socketio.tasks == 2
+
+
+def test_merges_posts_and_deletions_in_order(scheduler, sent):
+    scheduler.post_added({'id': 1})
+    scheduler.posts_deleted([5, 3])
+    scheduler.post_added({'id': 2})
+    scheduler.posts_deleted([3, 1])
+    scheduler.flush()
+    assert sent == [('batch', {'cleared': False, 'posts': [{'id': 1}, {'id': 2}], 'deleted_ids': [5, 3, 1]}, None)]
+
+
+def test_clear_drops_earlier_changes(scheduler, sent):
+    scheduler.post_added({'id': 1})
+    scheduler.posts_deleted([1])
+    scheduler.posts_cleared()
+    scheduler.post_added({'id': 1})
+    scheduler.flush()
+    assert sent == [('batch', {'cleared': True, 'posts': [{'id': 1}], 'deleted_ids': []}, None)]
+
+
+def test_only_last_topic_is_sent(scheduler, sent):
+    scheduler.topic_updated('a')
+    scheduler.topic_updated('b')
+    scheduler.flush()
+    assert sent == [('batch', {'cleared': False, 'posts': [], 'deleted_ids': [], 'topic': 'b'}, None)]
+
+
+def test_refresh_all_replaces_other_changes(scheduler, sent):
+    scheduler.post_added({'id': 1})
+    scheduler.refresh('sid1')
+    scheduler.refresh()
+    scheduler.topic_updated('a')
+    scheduler.flush()
+    assert sent == [('batch', {'snapshot': {'snapshot_number': 1}}, None)]
+
+
+def test_refresh_sids_share_one_snapshot_after_batch(scheduler, sent):
+    scheduler.post_added({'id': 1})
+    scheduler.refresh('sid1')
+    scheduler.refresh('sid2')
+    scheduler.refresh('sid1')
+    scheduler.flush()
+    assert sent[0][0] == 'batch'
+    assert sorted(sent[1:], key=lambda item: item[2]) == [
+        ('update_posts', {'snapshot_number': 1}, 'sid1'),
+        ('update_posts', {'snapshot_number': 1}, 'sid2'),
+    ]
+
+
+def test_flush_without_changes_sends_nothing(scheduler, sent):
+    scheduler.flush()
+    scheduler.post_added({'id': 1})
+    scheduler.flush()
+    scheduler.flush()
+    assert len(sent) == 1
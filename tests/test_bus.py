@@ -0,0 +1,100 @@
+"""バスの受信スレッドが、失敗のあとも配信を続けること"""
+import queue
+import sqlite3
+import time
+
+import pytest
+
+import bus
+
+
+@pytest.fixture(autouse=True)
+def short_retry(monkeypatch):
+    monkeypatch.setattr(bus, 'RETRY_DELAY', 0.01)
+
+
+def subscribe_queue(board_bus, channel='test'):
+    received = queue.Queue()
+    board_bus.subscribe(channel, received.put)
+    return received
+
+
+class FailingConnection:
+    """最初の failures 回の execute で database is locked を出す sqlite3 の接続"""
+
+    def __init__(self, connection, failures):
+        self.connection = connection
+        self.failures = failures
+
+    def execute(self, *args):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError('database is locked')
+        return self.connection.execute(*args)
+
+
+def test_sqlite_bus_keeps_delivering_after_callback_error(tmp_path):
+    board_bus = bus.SqliteBus(str(tmp_path / 'bus.db'), poll_interval=0.01)
+    calls = []
+
+    def fail_once(message):
+        calls.append(message)
+        if len(calls) == 1:
+            raise RuntimeError('handler error')
+
+    board_bus.subscribe('test', fail_once)
+    received = subscribe_queue(board_bus)
+    board_bus.publish('test', {'n': 1})
+    board_bus.publish('test', {'n': 2})
+    # 例外を出した購読者の後ろの購読者にも、次のメッセージも届く
+    assert received.get(timeout=5) == {'n': 1}
+    assert received.get(timeout=5) == {'n': 2}
+    assert calls == [{'n': 1}, {'n': 2}]
+
+
+def test_sqlite_bus_skips_malformed_message(tmp_path):
+    board_bus = bus.SqliteBus(str(tmp_path / 'bus.db'), poll_interval=0.01)
+    received = subscribe_queue(board_bus)
+    with board_bus.lock:
+        board_bus.connection.execute(
+            "INSERT INTO bus_messages (channel, payload, created_at) VALUES ('test', '{broken', 0)"
+        )
+    board_bus.publish('test', {'n': 1})
+    assert received.get(timeout=5) == {'n': 1}
+
+
+def test_sqlite_bus_retries_when_database_is_locked(tmp_path):
+    board_bus = bus.SqliteBus(str(tmp_path / 'bus.db'), poll_interval=0.01)
+    board_bus.publish('test', {'n': 1}) # 購読前だが、起動後のメッセージなので届く
+    board_bus.connection = FailingConnection(board_bus.connection, failures=3)
+    received = subscribe_queue(board_bus)
+    assert received.get(timeout=5) == {'n': 1}
+    assert board_bus.poller.is_alive()
+
+
+def test_redis_bus_resubscribes_after_disconnect():
+    fakeredis = pytest.importorskip('fakeredis')
+    board_bus = bus.RedisBus('redis://localhost:6379/0', poll_interval=0.01)
+    board_bus.client = fakeredis.FakeRedis()
+    board_bus.pubsub = board_bus.client.pubsub(ignore_subscribe_messages=True)
+    received = subscribe_queue(board_bus)
+    board_bus.client.publish('test', b'{"n": 1}')
+    assert received.get(timeout=5) == {'n': 1}
+
+    # 購読用の接続が切れる
+    broken = board_bus.pubsub
+
+    def disconnected(**kwargs):
+        raise bus.redis.ConnectionError('connection lost')
+
+    with board_bus.lock:
+        broken.get_message = disconnected
+
+    # 接続を作り直して購読し直し、その後のメッセージは届く
+    deadline = time.monotonic() + 5
+    while board_bus.pubsub is broken or not board_bus.client.pubsub_numsub('test')[0][1]:
+        assert time.monotonic() < deadline, '購読し直していません'
+        time.sleep(0.01)
+    board_bus.publish('test', {'n': 2})
+    assert received.get(timeout=5) == {'n': 2}
+    assert board_bus.listener.is_alive()
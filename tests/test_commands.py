@@ -0,0 +1,97 @@
+"""スラッシュコマンドの表（必要な権限の確認と引数の解析）"""
+import pytest
+
+from commands import PERMISSION_DENIED, ROLE_LEVELS, Caller, CommandRegistry, id_list, integer, user_id
+
+ROLES = sorted(ROLE_LEVELS, key=ROLE_LEVELS.get)
+
+
+@pytest.fixture
+def registry():
+    registry = CommandRegistry()
+    calls = []
+
+    @registry.register('/echo')
+    def echo(caller, arg):
+        calls.append(arg)
+        return 'info', arg
+
+    @registry.register('/count', 'moderator', parse=integer('数を指定してください。'))
+    def count(caller, n):
+        calls.append(n)
+        return 'success', str(n + 1)
+
+    registry.calls = calls
+    return registry
+
+
+def caller(role):
+    return Caller('ABCDEF0', role, None)
+
+
+def test_unknown_command(registry):
+    assert registry.dispatch('/nothing 1', caller('operator')) == ('error', '不明なコマンド: /nothing')
+
+
+@pytest.mark.parametrize('role', ROLES)
+def test_min_role(registry, role):
+    result = registry.dispatch('/count 1', caller(role))
+    if ROLE_LEVELS[role] >= ROLE_LEVELS['moderator']:
+        assert result == ('success', '2')
+    else:
+        assert result == ('error', PERMISSION_DENIED)
+
+
+def test_denied_command_does_not_parse_or_run(registry):
+    assert registry.dispatch('/count abc', caller('normal')) == ('error', PERMISSION_DENIED)
+    assert registry.calls == []
+
+
+def test_unknown_role_is_normal(registry):
+    assert registry.dispatch('/count 1', caller('nobody')) == ('error', PERMISSION_DENIED)
+    assert registry.dispatch('/echo hi', caller('nobody')) == ('info', 'hi')
+
+
+def test_parse_error_is_shown_and_handler_not_called(registry):
+    assert registry.dispatch('/count abc', caller('operator')) == ('error', '数を指定してください。')
+    assert registry.calls == []
+
+
+def test_without_parse_passes_raw_argument(registry):
+    assert registry.dispatch('/echo  a b ', caller('normal')) == ('info', ' a b ')
+    assert registry.dispatch('/echo', caller('normal')) == ('info', '')
+
+
+def test_user_id_parser():
+    parse = user_id('IDを指定してください。')
+    assert parse(' abcdef0 ') == 'ABCDEF0'
+    for arg in ['', 'ABCDEF', 'ABCDEF01', 'GHIJKL0', 'ABC DEF']:
+        with pytest.raises(ValueError, match='IDを指定してください。'):
+            parse(arg)
+
+
+def test_id_list_parser():
+    parse = id_list('IDを指定してください。')
+    assert parse('3, 1,3,2') == [3, 1, 2]
+    with pytest.raises(ValueError):
+        parse('1,,2')
+
+
+# 掲示板に登録されているコマンドの必要権限（1つ下の権限では実行できない）
+@pytest.mark.parametrize('message, min_role', [
+    ('/del 1', 'speaker'),
+    ('/add x', 'speaker'),
+    ('/speaker ABCDEF1', 'manager'),
+    ('/range 10', 'manager'),
+    ('/moderator ABCDEF1', 'summit'),
+    ('/kill ABCDEF1', 'operator'),
+    ('/ban 192.0.2.1', 'operator'),
+    ('/board test x', 'operator'),
+    ('/profile 1', 'operator'),
+])
+def test_app_command_min_roles(bbs, message, min_role):
+    name = message.partition(' ')[0]
+    assert bbs.commands.commands[name].min_level == ROLE_LEVELS[min_role]
+    below = ROLES[ROLE_LEVELS[min_role] - 1]
+    result = bbs.commands.dispatch(message, Caller('ABCDEF0', below, bbs.boards.get('main')))
+    assert result == ('error', PERMISSION_DENIED)
@@ -0,0 +1,23 @@
+"""/metrics・/debug/profile は監視用のトークンを持つリクエストにだけ返す"""
+import pytest
+
+
+@pytest.fixture
+def client(bbs):
+    return bbs.app.test_client()
+
+
+@pytest.mark.parametrize('path', ['/metrics', '/debug/profile'])
+def test_forbidden_without_token_configured(client, path):
+    # 同じマシンのリバースプロキシ経由（127.0.0.1）でも返さない
+    assert client.get(path).status_code == 403
+    assert client.get(path, environ_base={'REMOTE_ADDR': 'unix:/run/app.sock'}).status_code == 403
+
+
+@pytest.mark.parametrize('path', ['/metrics', '/debug/profile'])
+def test_requires_token(bbs, client, monkeypatch, path):
+    monkeypatch.setattr(bbs, 'MONITORING_TOKEN', 'secret')
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert client.get(path, headers={'Authorization': 'Bearer ｓecret'}).status_code == 403
+    assert client.get(path, headers={'Authorization': 'Bearer secret'}).status_code == 200
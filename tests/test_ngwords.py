@@ -0,0 +1,59 @@
+"""NgWordMatcher（単語が少ないときの `in` による照合と、Aho-Corasick による照合の両方）"""
+import pytest
+
+from ngwords import LOOP_THRESHOLD, NgWordMatcher
+
+
+@pytest.fixture(params=['loop', 'automaton'])
+def make_matcher(request):
+    """照合方法を切り替えて NgWordMatcher を作る（automaton ではどの投稿にも含まれない単語で数を増やす）"""
+    def make(words, normalize=True):
+        filler = [f'〓{i}〓' for i in range(LOOP_THRESHOLD)] if request.param == 'automaton' else []
+        return NgWordMatcher(list(words) + filler, normalize=normalize)
+    return make
+
+
+@pytest.mark.parametrize('words, message, expected', [
+    (['he', 'she', 'his', 'hers'], 'ushers', True),
+    (['he', 'she', 'his', 'hers'], 'hi', False),
+    (['abcd', 'bc'], 'abce', True), # 長い単語を辿る途中で、失敗遷移の先の短い単語に当たる
+    (['abcd', 'bcx'], 'abcx', True),
+    (['abcd'], 'abcabc', False),
+    (['荒らし'], 'これは荒らしです', True),
+    (['荒らし'], '荒し', False),
+    (['abc'], 'xxabc', True), # 末尾
+    ([''], 'abc', False), # 空の単語は登録しない
+    ([], 'abc', False),
+])
+def test_search(make_matcher, words, message, expected):
+    assert make_matcher(words).search(message) is expected
+
+
+@pytest.mark.parametrize('word, message, normalized, raw', [
+    ('ＡＢＣ', 'xabcx', True, False), # 全角英字と大文字
+    ('ｱｲｳ', 'アイウ', True, False), # 半角カナ
+    ('abc', 'ABC', True, False),
+    ('ＡＢＣ', 'xＡＢＣx', True, True),
+])
+def test_normalize_option(make_matcher, word, message, normalized, raw):
+    assert make_matcher([word], normalize=True).search(message) is normalized
+    assert make_matcher([word], normalize=False).search(message) is raw
+
+
+def test_add_and_remove(make_matcher):
+    matcher = make_matcher(['abc'])
+    matcher.add('xyz')
+    assert matcher.search('--xyz--')
+    matcher.remove('abc')
+    assert not matcher.search('--abc--')
+    matcher.remove('missing') # 登録していない単語は無視する
+    assert matcher.search('--xyz--')
+
+
+def test_remove_keeps_words_equal_after_normalize(make_matcher):
+    # /NG abc と /NG ＡＢＣ は正規化すると同じ単語なので、両方を /OK するまで残る
+    matcher = make_matcher(['abc', 'ＡＢＣ'])
+    matcher.remove('abc')
+    assert matcher.search('abc')
+    matcher.remove('ＡＢＣ')
+    assert not matcher.search('abc')
@@ -0,0 +1,80 @@
+"""板のページの配信（版数ごとの ETag と 304、投稿直後のその人向けのページ）"""
+import pytest
+
+
+@pytest.fixture
+def client(bbs):
+    return bbs.app.test_client()
+
+
+def get_page(client, board, **headers):
+    return client.get(f'/b/{board.id}', headers=headers)
+
+
+def test_unchanged_page_returns_304(client, board):
+    first = get_page(client, board)
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'no-cache'
+    etag = first.headers['ETag']
+    again = get_page(client, board, **{'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+
+
+def test_change_invalidates_etag(client, board, add_posts):
+    etag = get_page(client, board).headers['ETag']
+    add_posts(board, 1)
+    response = get_page(client, board, **{'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert '投稿0' in response.get_data(as_text=True)
+
+
+def test_etag_differs_per_encoding(client, board):
+    identity = get_page(client, board, **{'Accept-Encoding': 'identity'})
+    gzip = get_page(client, board, **{'Accept-Encoding': 'gzip'})
+    assert gzip.headers['Content-Encoding'] == 'gzip'
+    assert identity.headers['ETag'] != gzip.headers['ETag']
+    assert 'Accept-Encoding' in gzip.headers['Vary']
+    # gzip の ETag ではそのまま（identity）のページを 304 にしない
+    response = get_page(client, board, **{'Accept-Encoding': 'identity', 'If-None-Match': gzip.headers['ETag']})
+    assert response.status_code == 200
+
+
+def test_reloading_board_changes_etag(bbs, client, board):
+    etag = get_page(client, board).headers['ETag']
+    with bbs.boards.lock:
+        del bbs.boards.boards[board.id] # メモリから外す
+    reloaded = bbs.boards.get(board.id)
+    reloaded.loaded_at = board.loaded_at + 1
+    assert get_page(client, reloaded, **{'If-None-Match': etag}).status_code == 200
+
+
+def test_flash_page_is_private_and_not_cached(bbs, client, board, monkeypatch):
+    monkeypatch.setattr(bbs, 'RATE_LIMIT_ENABLED', False)
+    etag = get_page(client, board).headers['ETag']
+    response = client.post('/post', data={'board': board.id, 'name': '名無し', 'seed': 's', 'message': '/unknown'})
+    assert response.status_code == 302
+
+    # 結果の表示と前回の入力内容を入れた、その人だけのページ（共有の ETag では 304 にしない）
+    page = get_page(client, board, **{'If-None-Match': etag})
+    assert page.status_code == 200
+    assert page.headers['Cache-Control'] == 'private, no-store'
+    assert 'ETag' not in page.headers
+    body = page.get_data(as_text=True)
+    assert '不明なコマンド: /unknown' in body
+    assert '>/unknown</textarea>' in body
+    assert 'value="名無し"' in body
+
+    # 表示した後は共有のページに戻る
+    after = get_page(client, board)
+    assert after.headers['Cache-Control'] == 'no-cache'
+    assert '不明なコマンド' not in after.get_data(as_text=True)
+    assert after.headers['ETag'] == etag
+
+
+def test_shared_page_is_reused_between_clients(bbs, board):
+    first = get_page(bbs.app.test_client(), board)
+    second = get_page(bbs.app.test_client(), board)
+    assert first.get_data() == second.get_data()
+    assert first.headers['ETag'] == second.headers['ETag']
@@ -0,0 +1,31 @@
+"""再同期要求（request_posts_update）への差分の返し方"""
+
+
+def test_small_gap_returns_delta(bbs, board, add_posts):
+    add_posts(board, 10)
+    delta = bbs.get_posts_since(board, 7)
+    assert [post['id'] for post in delta] == [10, 9, 8]
+    assert bbs.get_posts_since(board, 10) == []
+
+
+def test_large_gap_falls_back_to_snapshot(bbs, board, add_posts):
+    bbs.update_board_settings(board, page_size=5)
+    add_posts(board, 20)
+    assert len(bbs.get_posts_since(board, 15)) == 5
+    assert bbs.get_posts_since(board, 14) is None
+
+
+def test_no_posts_on_client_falls_back_to_snapshot(bbs, board, add_posts):
+    assert bbs.get_posts_since(board, 0) is None
+    add_posts(board, 3)
+    assert bbs.get_posts_since(board, 0) is None
+    assert bbs.get_posts_since(board, -1) is None
+    assert bbs.get_posts_since(board, 4) is None # /clear 前のID
+
+
+def test_range_is_capped(bbs, board):
+    caller = bbs.Caller('C000000', 'manager', board)
+    assert bbs.commands.dispatch(f'/range {bbs.MAX_PAGE_SIZE}', caller)[0] == 'success'
+    assert bbs.commands.dispatch(f'/range {bbs.MAX_PAGE_SIZE + 1}', caller)[0] == 'error'
+    assert bbs.commands.dispatch('/range 0', caller)[0] == 'error'
+    assert board.page_size == bbs.MAX_PAGE_SIZE
@@ -0,0 +1,132 @@
+"""PostStore（上限付きの投稿置き場）"""
+import random
+
+import pytest
+
+import poststore
+from poststore import Post, PostStore
+
+
+def post(post_id):
+    return Post(post_id, '名無し', f'投稿{post_id}', 'ABCDEF0')
+
+
+def ids(posts):
+    return [p.id for p in posts]
+
+
+def make_store(capacity, post_ids):
+    return PostStore(capacity, (post(i) for i in post_ids))
+
+
+def test_append_evicts_oldest():
+    store = make_store(3, [1, 2, 3])
+    assert ids(store.append(post(4))) == [1]
+    assert ids(store.newest()) == [4, 3, 2]
+    assert store.latest_id() == 4
+    assert 1 not in store
+
+
+def test_append_ignores_duplicate():
+    store = make_store(3, [1, 2])
+    assert store.append(post(2)) == []
+    assert len(store) == 2
+
+
+def test_out_of_order_append_keeps_id_order():
+    # 他のワーカーの投稿が前後して届く
+    store = make_store(10, [1, 2, 5])
+    store.append(post(3))
+    assert ids(store.newest()) == [5, 3, 2, 1]
+
+
+def test_out_of_order_append_older_than_everything_is_evicted_first():
+    store = make_store(2, [5, 6])
+    assert ids(store.append(post(4))) == [4]
+    assert ids(store.newest()) == [6, 5]
+
+
+def test_reappending_deleted_id_does_not_duplicate():
+    store = make_store(10, [1, 2, 3])
+    store.delete([2])
+    store.append(post(2))
+    assert ids(store.newest()) == [3, 2, 1]
+    store.delete([3])
+    store.append(post(3))
+    assert ids(store.newest()) == [3, 2, 1]
+
+
+def test_delete_returns_only_existing_posts():
+    store = make_store(10, [1, 2, 3])
+    assert ids(store.delete([2, 9, 2])) == [2]
+    assert ids(store.newest()) == [3, 1]
+    assert len(store) == 2
+
+
+def test_deleted_posts_do_not_count_towards_capacity():
+    store = make_store(3, [1, 2, 3])
+    store.delete([2])
+    assert store.append(post(4)) == []
+    assert ids(store.append(post(5))) == [1]
+    assert ids(store.newest()) == [5, 4, 3]
+
+
+def test_set_capacity_evicts_oldest():
+    store = make_store(5, [1, 2, 3, 4, 5])
+    assert ids(store.set_capacity(2)) == [1, 2, 3]
+    assert ids(store.newest()) == [5, 4]
+
+
+def test_clear():
+    store = make_store(5, [1, 2, 3])
+    store.clear()
+    assert len(store) == 0
+    assert store.latest_id() is None
+    store.append(post(1)) # /clear で投稿番号は1に戻る
+    assert ids(store.newest()) == [1]
+
+
+@pytest.mark.parametrize('kwargs, expected', [
+    ({'limit': 2}, [10, 9]),
+    ({'before': 8, 'limit': 3}, [7, 6, 4]),
+    ({'before': 5}, [4, 3, 2, 1]),
+    ({'after': 7}, [10, 9, 8]),
+    ({'before': 9, 'after': 4}, [8, 7, 6]),
+    ({'before': 1}, []),
+    ({'after': 10}, []),
+])
+def test_newest(kwargs, expected):
+    store = make_store(20, range(1, 11))
+    store.delete([5])
+    assert ids(store.newest(**kwargs)) == expected
+
+
+def test_compaction_keeps_contents(monkeypatch):
+    monkeypatch.setattr(poststore, 'COMPACT_THRESHOLD', 4)
+    store = make_store(100, range(1, 51))
+    store.delete(range(1, 40, 2))
+    for post_id in range(51, 200):
+        store.append(post(post_id))
+    expected = sorted((i for i in range(1, 200) if not (i < 40 and i % 2)), reverse=True)[:100]
+    assert ids(store.newest()) == expected
+    assert len(store.ids) - store.start < 200 # 削除済み・追い出し済みのIDは詰め直されている
+
+
+def test_random_operations_keep_invariants():
+    """ランダムな操作の後も、新しい順・重複なし・上限以内・len と一致する"""
+    rng = random.Random(0)
+    store = PostStore(30)
+    for _ in range(5000):
+        operation = rng.random()
+        if operation < 0.6:
+            store.append(post(rng.randint(1, 300)))
+        elif operation < 0.9:
+            store.delete([rng.randint(1, 300) for _ in range(3)])
+        elif operation < 0.99:
+            store.set_capacity(rng.randint(1, 40))
+        else:
+            store.clear()
+        newest = ids(store.newest())
+        assert newest == sorted(set(newest), reverse=True)
+        assert len(newest) == len(store) <= store.capacity
+        assert store.latest_id() == (newest[0] if newest else None)
@@ -0,0 +1,53 @@
+"""TokenBucketLimiter（キーごとのトークンバケット）"""
+import pytest
+
+from ratelimit import TokenBucketLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_burst_then_wait(clock):
+    limiter = TokenBucketLimiter(clock=clock)
+    assert [limiter.acquire('a', 0.5, 3) for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire('a', 0.5, 3) == pytest.approx(2) # 1トークンたまるまで 1 / 0.5 秒
+
+
+def test_refill_over_time_up_to_burst(clock):
+    limiter = TokenBucketLimiter(clock=clock)
+    for _ in range(3):
+        limiter.acquire('a', 1, 3)
+    clock.now = 1.5
+    assert limiter.acquire('a', 1, 3) == 0
+    assert limiter.acquire('a', 1, 3) == pytest.approx(0.5) # 残り 0.5 トークン
+    clock.now = 100 # 長く空けても burst 個まで
+    assert [limiter.acquire('a', 1, 3) for _ in range(4)][-1] > 0
+
+
+def test_keys_are_independent(clock):
+    limiter = TokenBucketLimiter(clock=clock)
+    limiter.acquire('a', 1, 1)
+    assert limiter.acquire('a', 1, 1) > 0
+    assert limiter.acquire('b', 1, 1) == 0
+
+
+def test_evicts_least_recently_used_key(clock):
+    limiter = TokenBucketLimiter(max_keys=2, clock=clock)
+    limiter.acquire('a', 1, 1)
+    limiter.acquire('b', 1, 1)
+    limiter.acquire('a', 1, 1) # a を使ったので、次に捨てるのは b
+    limiter.acquire('c', 1, 1)
+    assert len(limiter) == 2
+    assert list(limiter.buckets) == ['a', 'c']
+    # 捨てられた b は満タンのバケットからやり直す
+    assert limiter.acquire('b', 1, 1) == 0
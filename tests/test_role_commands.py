@@ -0,0 +1,45 @@
+"""権限の付与・解除コマンド（権限は全員で共有するので、上位のユーザーを変えられないこと）"""
+import pytest
+
+from commands import Caller
+
+
+def run(bbs, role, message, display_id='C000000'):
+    return bbs.commands.dispatch(message, Caller(display_id, role, bbs.boards.get('main')))
+
+
+@pytest.fixture
+def users(bbs):
+    roles = {'B000001': 'speaker', 'B000002': 'manager', 'B000003': 'moderator', 'B000004': 'summit', 'B000005': 'operator'}
+    for display_id, role in roles.items():
+        bbs.set_user_role(display_id, role)
+    return {role: display_id for display_id, role in roles.items()}
+
+
+def test_grants_and_revokes_lower_roles(bbs, users):
+    target = 'B000010'
+    assert run(bbs, 'manager', f'/speaker {target}')[0] == 'success'
+    assert bbs.get_user_role(target) == 'speaker'
+    assert run(bbs, 'manager', f'/disspeaker {target}')[0] == 'success'
+    assert bbs.get_user_role(target) == 'normal'
+
+
+@pytest.mark.parametrize('caller_role, message, target_role', [
+    ('manager', '/speaker', 'operator'),
+    ('manager', '/speaker', 'manager'),
+    ('manager', '/disspeaker', 'moderator'),
+    ('moderator', '/dismanager', 'summit'),
+    ('summit', '/dismoderator', 'summit'),
+    ('operator', '/dissummit', 'operator'),
+])
+def test_refuses_equal_or_higher_target(bbs, users, caller_role, message, target_role):
+    target = users[target_role]
+    category, _ = run(bbs, caller_role, f'{message} {target}')
+    assert category == 'error'
+    assert bbs.get_user_role(target) == target_role
+
+
+def test_operator_keeps_commands(bbs, users):
+    run(bbs, 'manager', f'/speaker {users["operator"]}')
+    assert bbs.get_user_role(users['operator']) == 'operator'
+    assert run(bbs, bbs.get_user_role(users['operator']), '/kill B000099')[0] == 'success'
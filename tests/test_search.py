@@ -0,0 +1,60 @@
+"""PostIndex（投稿本文の2-gram転置インデックス）"""
+import pytest
+
+from search import PostIndex
+
+
+@pytest.fixture
+def index():
+    index = PostIndex()
+    for post_id, message in enumerate(['こんにちは世界', '世界の果て', 'こんばんは', 'abcabc', 'x'], start=1):
+        index.add(post_id, message)
+    return index
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('世界', {1, 2}),
+    ('こん', {1, 3}),
+    ('にちは世', {1}),
+    ('界の果', {2}),
+    ('はこ', set()), # どの投稿にもない2-gram
+    ('世果', set()), # 各文字はあるが、並んではいない
+    ('cabc', {4}),
+    ('x', {5}), # 1文字のクエリは全投稿を候補にする
+    ('は', {1, 3}),
+    ('', set()),
+    ('こんにちは世界!', set()), # 本文より長い
+])
+def test_search(index, query, expected):
+    assert index.search(query) == expected
+
+
+def test_bigrams_present_but_not_adjacent():
+    # 「ab」「bc」はどちらも含むが「abc」は含まない投稿は、最後に本文で確認して除く
+    index = PostIndex()
+    index.add(1, 'ab-bc')
+    index.add(2, 'xabcx')
+    assert index.search('abc') == {2}
+
+
+def test_search_after_remove(index):
+    index.remove(1)
+    assert index.search('世界') == {2}
+    assert index.search('こん') == {3}
+    assert 'にち' not in index.postings # 他の投稿にない2-gramは消える
+    index.remove(1) # 2回目は何もしない
+    index.remove(99)
+    assert index.search('世界') == {2}
+
+
+def test_readd_after_remove(index):
+    index.remove(2)
+    index.add(2, '新しい世界')
+    assert index.search('世界') == {1, 2}
+    assert index.search('果て') == set()
+
+
+def test_clear(index):
+    index.clear()
+    assert index.search('世界') == set()
+    assert index.search('x') == set()
@@ -0,0 +1,96 @@
+"""同じDBと SqliteBus を共有する2つのプロセスの間で、状態の変更が伝わることを確かめる"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bus_worker.py')
+TIMEOUT = 10 # 秒
+
+
+class Worker:
+    def __init__(self, env):
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER], cwd=ROOT, env=env, text=True,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        assert self.read() == {'ready': True}
+
+    def read(self):
+        line = self.process.stdout.readline()
+        assert line, 'ワーカーが終了しました'
+        return json.loads(line)
+
+    def call(self, op, **kwargs):
+        self.process.stdin.write(json.dumps({'op': op, **kwargs}) + '\n')
+        self.process.stdin.flush()
+        return self.read()
+
+    def wait_for(self, condition, board='main'):
+        """condition(state) が真になるまで状態を読み直す（バスはポーリングで届く）"""
+        deadline = time.monotonic() + TIMEOUT
+        while True:
+            state = self.call('state', board=board)
+            if condition(state):
+                return state
+            assert time.monotonic() < deadline, f'変更が届きませんでした: {state}'
+            time.sleep(0.05)
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait(TIMEOUT)
+
+
+@pytest.fixture
+def workers(tmp_path):
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{tmp_path / "bbs.db"}',
+        BOARD_BUS_URL=f'sqlite:///{tmp_path / "bus.db"}',
+        SOCKETIO_ASYNC_MODE='threading',
+        PYTHONPATH=ROOT,
+    )
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    started = []
+    try:
+        # テーブルを作るのは最初のプロセスに任せる
+        for _ in range(2):
+            started.append(Worker(env))
+        yield started
+    finally:
+        for worker in started:
+            worker.close()
+
+
+def test_changes_propagate_between_processes(workers):
+    writer, reader = workers
+    # 読む側は先に板を読み込んでおく（読み込んでいない板への変更は、読み込むときにDBから読む）
+    assert reader.call('state', board='main')['posts'] == []
+
+    # 権限の変更（運営は表示用IDに直接付与する）
+    operator = writer.call('display_id', name='運営', seed='seed')
+    writer.call('grant', display_id=operator, role='operator')
+    reader.wait_for(lambda state: state['user_roles'].get(operator) == 'operator')
+
+    # 投稿
+    result = writer.call('submit', board='main', name='名無し', message='こんにちは', seed='seed', ip='192.0.2.1')
+    assert result['ok'], result
+    state = reader.wait_for(lambda state: state['posts'])
+    assert [(post['id'], post['message']) for post in state['posts']] == [(result['post_id'], 'こんにちは')]
+
+    # コマンドによる権限の変更
+    target = writer.call('display_id', name='名無し', seed='seed')
+    result = writer.call('submit', board='main', name='運営', message=f'/moderator {target}', seed='seed', ip='192.0.2.9')
+    assert result['ok'], result
+    reader.wait_for(lambda state: state['user_roles'].get(target) == 'moderator')
+
+    # 投稿番号を指定した /ban。読む側のプロセスでも、BANしたIPからの投稿を受け付けない
+    result = writer.call('submit', board='main', name='運営', message=f'/ban {state["posts"][0]["id"]}', seed='seed', ip='192.0.2.9')
+    assert result['ok'], result
+    reader.wait_for(lambda state: '192.0.2.1' in state['blocklists']['ip'])
+    result = reader.call('submit', board='main', name='別人', message='投稿', seed='other', ip='192.0.2.1')
+    assert not result['ok']
@@ -0,0 +1,28 @@
+"""投稿の受け付け（submit_message）"""
+import pytest
+from sqlalchemy import select
+
+
+@pytest.fixture
+def submit(bbs, monkeypatch):
+    monkeypatch.setattr(bbs, 'RATE_LIMIT_ENABLED', False)
+
+    def submit(board, message, name='名無し', seed='seed', ip='192.0.2.1'):
+        with bbs.app.test_request_context():
+            return bbs.submit_message(board, name, message, seed, ip)
+    return submit
+
+
+def stored_post_ids(bbs, board):
+    Post = bbs.storage.Post
+    return bbs.storage.db.session.execute(
+        select(Post.id).where(Post.board_id == board.id).order_by(Post.id)
+    ).scalars().all()
+
+
+def test_full_board_deletes_evicted_posts_from_db(bbs, board, submit):
+    bbs.update_board_settings(board, max_posts=5)
+    for i in range(8):
+        assert submit(board, f'投稿{i}')['ok']
+    assert stored_post_ids(bbs, board) == [4, 5, 6, 7, 8]
+    assert [post.id for post in board.posts.newest()] == [8, 7, 6, 5, 4]